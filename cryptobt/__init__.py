@@ -1,3 +1,46 @@
-from .cryptobroker import *
-from .cryptofeed import *
-from .cryptostore import *
+'''Crypto live data feed and trading support for backtrader.
+
+The submodules are imported on first access to one of their names, so that
+``import cryptobt`` does not pay for loading backtrader and ccxt (which
+imports every exchange class it ships). ccxt is only loaded when a
+``CryptoStore`` is created.
+'''
+import importlib
+
+_modules = {
+    'cryptoarrow': ('open_dataset', 'cached_series', 'dataset_series', 'export_cache', 'import_cache', 'scan_ohlcv'),
+    'cryptobook': ('OrderBookBuffer', 'OrderBookRecorder', 'read_order_book', 'CryptoBookFeed'),
+    'cryptobroker': ('CryptoOrder', 'MetaCryptoBroker', 'CryptoBroker'),
+    'cryptocheckpoint': ('Checkpoint',),
+    'cryptodispatch': ('OrderDispatcher',),
+    'cryptofeed': ('MetaCryptoFeed', 'CryptoFeed'),
+    'cryptoledger': ('CryptoLedger',),
+    'cryptolog': ('StructLogger', 'get_logger', 'configure_logging', 'JsonFormatter', 'TextFormatter',
+                  'SampleFilter', 'RateLimitFilter', 'BackgroundHandler'),
+    'cryptomarkets': ('MarketInfo', 'MarketIndex'),
+    'cryptometrics': ('MethodStats', 'StoreMetrics'),
+    'cryptoohlcv': ('OHLCVStats', 'validate_ohlcv', 'fill_gaps', 'align_asof'),
+    'cryptoprefetch': ('OHLCVPrefetcher',),
+    'cryptosim': ('SimulatedExchange',),
+    'cryptostore': ('MetaSingleton', 'CryptoStore'),
+    'cryptostream': ('OrderStream', 'CcxtProOrderStream', 'SimulatedOrderStream'),
+    'cryptotrace': ('Span', 'LatencyTracer', 'TraceAnalyzer'),
+    'cryptotransport': ('ReplayMismatch', 'RecordingExchange', 'ReplayExchange'),
+}
+
+_exports = {name: module for module, names in _modules.items() for name in names}
+
+__all__ = sorted(_exports)
+
+
+def __getattr__(name):
+    module = _exports.get(name)
+    if module is None:
+        raise AttributeError("module '%s' has no attribute '%s'" % (__name__, name))
+    value = getattr(importlib.import_module('.' + module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_exports))
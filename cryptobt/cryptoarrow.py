@@ -0,0 +1,235 @@
+'''Arrow/Parquet datasets of OHLCV candles.
+
+Datasets are partitioned hive style by ``symbol`` and ``granularity``
+(e.g. ``symbol=BTC%2FUSDT/granularity=1m/part-0.parquet``) with the columns
+``timestamp`` (``timestamp[ms, UTC]``), ``open``, ``high``, ``low``,
+``close`` and ``volume``, so pandas, polars or duckdb can scan them
+directly. Datasets holding a single series may leave the ``symbol`` and
+``granularity`` columns out; ``timestamp`` may also be epoch milliseconds.
+
+pyarrow is an optional dependency (``pip install cryptobt[arrow]``), only
+imported when one of these functions is called.
+'''
+import os
+import re
+from datetime import datetime
+
+from .cryptoohlcv import validate_ohlcv
+
+OHLCV_COLUMNS = ('timestamp', 'open', 'high', 'low', 'close', 'volume')
+PARTITION_COLUMNS = ('symbol', 'granularity')
+
+_GRANULARITY = re.compile(r'^\d+[smhd]$')  # the granularities TimeSeriesCache supports
+_EPOCH = datetime(1970, 1, 1)
+_UNITS = {'s': 0.001, 'ms': 1, 'us': 1000, 'ns': 1000000}
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.dataset
+    except ImportError:
+        raise ImportError('pyarrow is required for Arrow/Parquet datasets: pip install cryptobt[arrow]')
+    return pyarrow
+
+
+def _ms(dt):
+    return int((dt - _EPOCH).total_seconds() * 1000)
+
+
+def _schema(pa):
+    return pa.schema([('timestamp', pa.timestamp('ms', tz='UTC'))] +
+                     [(name, pa.float64()) for name in OHLCV_COLUMNS[1:]] +
+                     [(name, pa.string()) for name in PARTITION_COLUMNS])
+
+
+def _partitioning(pa):
+    return pa.dataset.partitioning(pa.schema([(name, pa.string()) for name in PARTITION_COLUMNS]), flavor='hive')
+
+
+def open_dataset(source, format='parquet'):
+    '''Returns ``source`` as a ``pyarrow.dataset.Dataset`` (a path is opened with hive partitioning)'''
+    pa = _pyarrow()
+    if isinstance(source, pa.dataset.Dataset):
+        return source
+    return pa.dataset.dataset(source, format=format, partitioning='hive')
+
+
+def cached_series(basedir):
+    '''Yields ``(symbol, granularity, block_paths)`` for every OHLCV series of a ``TimeSeriesCache`` directory
+
+    The block paths are sorted by block index. Derivatives series
+    (``symbol#series`` keys) are left out.
+    '''
+    for dirpath, dirnames, filenames in os.walk(basedir):
+        granularity = os.path.basename(dirpath)
+        blocks = sorted((int(name), name) for name in filenames if name.isdigit())
+        if not blocks or not _GRANULARITY.match(granularity):
+            continue
+        symbol = os.path.relpath(os.path.dirname(dirpath), basedir).replace(os.sep, '/')
+        if '#' in symbol:
+            continue
+        yield symbol, granularity, [os.path.join(dirpath, name) for _, name in blocks]
+
+
+def export_cache(cache, path, symbols=None, granularities=None, format='parquet'):
+    '''Writes the candles of a ``TimeSeriesCache`` (e.g. ``CryptoStore.cache``) to a dataset at ``path``
+
+    Every cache block becomes a record batch, so memory use does not grow
+    with the size of the cache. The partitions written are replaced.
+    ``symbols``/``granularities`` restrict the series exported.
+    ``format`` is any pyarrow dataset format (``'parquet'``, ``'ipc'``
+    for Arrow files ...). Returns the number of candles written.
+    '''
+    from tscache import tscache
+    pa = _pyarrow()
+    schema = _schema(pa)
+    written = [0]
+
+    def batches():
+        for symbol, granularity, paths in cached_series(cache.basedir):
+            if symbols is not None and symbol not in symbols or \
+                    granularities is not None and granularity not in granularities:
+                continue
+            for block_path in paths:
+                rows = validate_ohlcv(tscache._load_block_by_path(block_path))[0]
+                if not rows:
+                    continue
+                columns = [pa.array(column, type=field.type) for column, field in zip(zip(*rows), schema)]
+                columns.append(pa.array([symbol] * len(rows), type=pa.string()))
+                columns.append(pa.array([granularity] * len(rows), type=pa.string()))
+                written[0] += len(rows)
+                yield pa.RecordBatch.from_arrays(columns, schema=schema)
+
+    pa.dataset.write_dataset(batches(), path, schema=schema, format=format, partitioning=_partitioning(pa),
+                             existing_data_behavior='delete_matching')
+    return written[0]
+
+
+def _filter(pa, dataset, symbol, granularity, since=None, until=None):
+    '''Predicate selecting a series, from ``since`` to ``until`` (epoch ms, exclusive) if given'''
+    field = pa.dataset.field
+    names = dataset.schema.names
+    expr = None
+    for name, value in zip(PARTITION_COLUMNS, (symbol, granularity)):
+        if name in names:
+            term = field(name) == value
+            expr = term if expr is None else expr & term
+
+    ts_type = dataset.schema.field('timestamp').type
+    for ms, op in ((since, 'ge'), (until, 'lt')):
+        if ms is None:
+            continue
+        if pa.types.is_timestamp(ts_type):
+            value = pa.scalar(int(ms * _UNITS[ts_type.unit]), type=ts_type)
+        else:
+            value = pa.scalar(ms, type=ts_type)
+        term = field('timestamp') >= value if op == 'ge' else field('timestamp') < value
+        expr = term if expr is None else expr & term
+    return expr
+
+
+def _timestamps(pa, column):
+    '''Converts a ``timestamp`` column to epoch milliseconds (``int64``)'''
+    if pa.types.is_timestamp(column.type):
+        if column.type.unit != 'ms':
+            column = column.cast(pa.timestamp('ms', tz=column.type.tz), safe=False)
+        column = column.cast(pa.int64())
+    return column
+
+
+def scan_ohlcv(source, symbol, granularity, start=None, end=None, format='parquet', batch_size=100000):
+    '''Yields the candles of a series of a dataset from ``start`` to ``end`` (inclusive), batch by batch
+
+    Only the OHLCV columns are read and the series and time range are
+    pushed down to the scan, so partitions and row groups outside of them
+    are skipped. Every batch is a list of ccxt style ``[timestamp, open,
+    high, low, close, volume]`` rows, in the order of the dataset.
+    '''
+    pa = _pyarrow()
+    dataset = open_dataset(source, format)
+    until = _ms(end) + 1 if end is not None else None
+    expr = _filter(pa, dataset, symbol, granularity, _ms(start) if start is not None else None, until)
+    return _scan(pa, dataset, expr, batch_size)
+
+
+def _scan(pa, dataset, expr, batch_size=100000):
+    scanner = dataset.scanner(columns=list(OHLCV_COLUMNS), filter=expr, batch_size=batch_size)
+    for batch in scanner.to_batches():
+        if not batch.num_rows:
+            continue
+        columns = [_timestamps(pa, batch.column(0)).to_pylist()] + [batch.column(i).to_pylist()
+                                                        for i in range(1, len(OHLCV_COLUMNS))]
+        yield [list(row) for row in zip(*columns)]
+
+
+def dataset_series(source, format='parquet'):
+    '''Returns the sorted ``(symbol, granularity)`` pairs of a partitioned dataset'''
+    dataset = open_dataset(source, format)
+    table = dataset.to_table(columns=list(PARTITION_COLUMNS))
+    pairs = table.group_by(list(PARTITION_COLUMNS)).aggregate([])
+    return sorted(zip(*(pairs.column(name).to_pylist() for name in PARTITION_COLUMNS)))
+
+
+def import_cache(cache, source, symbols=None, granularities=None, format='parquet', overwrite=False):
+    '''Seeds a ``TimeSeriesCache`` with the candles of a dataset, without any exchange request
+
+    Partitioned datasets are imported series by series (restricted by
+    ``symbols``/``granularities``); a dataset without ``symbol`` and
+    ``granularity`` columns needs exactly one of each. The dataset is read
+    one cache block at a time.
+
+    A block missing from the cache is only written if the series covers its
+    whole time range, as the cache never fetches the rest of a block it
+    holds: the partial blocks at the ends of a series are left to the
+    exchange. Blocks already cached are merged with the imported candles,
+    the cached ones winning on equal timestamps unless ``overwrite`` is set.
+
+    Returns a dict with the number of ``rows`` and ``blocks`` written and of
+    blocks ``skipped``.
+    '''
+    from tscache import tscache
+    pa = _pyarrow()
+    dataset = open_dataset(source, format)
+    names = dataset.schema.names
+
+    if all(name in names for name in PARTITION_COLUMNS):
+        series = [(symbol, granularity) for symbol, granularity in dataset_series(dataset)
+                  if (symbols is None or symbol in symbols) and
+                  (granularities is None or granularity in granularities)]
+    elif symbols is not None and len(symbols) == 1 and granularities is not None and len(granularities) == 1:
+        series = [(symbols[0], granularities[0])]
+    else:
+        raise ValueError('a dataset without symbol and granularity columns needs a single symbol and granularity')
+
+    stats = dict(rows=0, blocks=0, skipped=0)
+    base = _ms(tscache.BASE_DATE)
+    for symbol, granularity in series:
+        bar = tscache._convert_granularity_to_seconds(granularity) * 1000
+        span = bar * cache.block_size
+
+        timestamps = dataset.to_table(columns=['timestamp'], filter=_filter(pa, dataset, symbol, granularity))
+        if not timestamps.num_rows:
+            continue
+        bounds = pa.compute.min_max(_timestamps(pa, timestamps.column(0)))
+        low, high = bounds['min'].as_py(), bounds['max'].as_py()
+        del timestamps
+
+        for block_index in range((low - base) // span, (high - base) // span + 1):
+            since = base + block_index * span
+            path = tscache._get_block_path(cache.basedir, symbol, granularity, block_index)
+            cached = os.path.isfile(path)
+            if not cached and (low > since or high < since + span - bar):
+                stats['skipped'] += 1
+                continue
+
+            expr = _filter(pa, dataset, symbol, granularity, since, since + span)
+            rows = [row for batch in _scan(pa, dataset, expr) for row in batch]
+            stats['rows'] += len(rows)
+            if cached:
+                block = tscache._load_block_by_path(path)
+                rows = block + rows if overwrite else rows + block  # the last one wins
+            tscache._save_block_to_path(path, validate_ohlcv(rows)[0])
+            stats['blocks'] += 1
+    return stats
@@ -0,0 +1,304 @@
+import gzip
+import json
+import time
+from array import array
+from datetime import datetime
+
+import backtrader as bt
+from backtrader.feed import DataBase
+
+from .cryptolog import get_logger, set_debug
+from .cryptostore import CryptoStore
+
+log = get_logger('book')
+
+_NAN = float('nan')
+
+
+class OrderBookBuffer(object):
+    '''Ring buffer of fixed depth order book snapshots.
+
+    Every snapshot is a row of ``1 + 4 * depth`` doubles in a single flat
+    ``array``: the timestamp, then the bid prices, bid sizes, ask prices and
+    ask sizes, best level first. Missing levels are ``nan``. Rows are written
+    in place, so the memory used does not grow with the number of snapshots
+    and no dict or list is kept per level.
+
+    Snapshots are addressed by their sequence number (``append`` returns
+    it); only the last ``maxlen`` ones are kept.
+    '''
+
+    def __init__(self, depth, maxlen=1000):
+        self.depth = depth
+        self.maxlen = maxlen
+        self.stride = 1 + 4 * depth
+        self.rows = array('d', [_NAN]) * (self.stride * maxlen)
+        self._pad = [_NAN] * depth
+        self.count = 0  # snapshots appended so far
+
+    def __len__(self):
+        return min(self.count, self.maxlen)
+
+    def _offset(self, seq):
+        if not self.count - self.maxlen <= seq < self.count or seq < 0:
+            raise IndexError('order book snapshot %d not in buffer' % seq)
+        return (seq % self.maxlen) * self.stride
+
+    def append(self, timestamp, bids, asks):
+        '''Stores ccxt ``bids``/``asks`` (``[[price, size], ...]``). Returns the sequence number'''
+        depth = self.depth
+        bids = bids[:depth]
+        asks = asks[:depth]
+        pad_bids = self._pad[len(bids):]
+        pad_asks = self._pad[len(asks):]
+        row = array('d', [timestamp])
+        row.extend([level[0] for level in bids] + pad_bids)
+        row.extend([level[1] for level in bids] + pad_bids)
+        row.extend([level[0] for level in asks] + pad_asks)
+        row.extend([level[1] for level in asks] + pad_asks)
+        return self.append_row(row)
+
+    def append_row(self, row):
+        '''Stores a row already in the buffer layout (e.g. read from a recording)'''
+        seq = self.count
+        offset = (seq % self.maxlen) * self.stride
+        self.rows[offset:offset + self.stride] = row
+        self.count += 1
+        return seq
+
+    def row(self, seq):
+        offset = self._offset(seq)
+        return self.rows[offset:offset + self.stride]
+
+    def timestamp(self, seq):
+        return self.rows[self._offset(seq)]
+
+    def _levels(self, seq, side):
+        offset = self._offset(seq) + 1 + side * 2 * self.depth
+        depth = self.depth
+        prices = self.rows[offset:offset + depth]
+        sizes = self.rows[offset + depth:offset + 2 * depth]
+        return [(price, size) for price, size in zip(prices, sizes) if price == price]
+
+    def bids(self, seq):
+        '''Returns the ``(price, size)`` bid levels of a snapshot'''
+        return self._levels(seq, 0)
+
+    def asks(self, seq):
+        '''Returns the ``(price, size)`` ask levels of a snapshot'''
+        return self._levels(seq, 1)
+
+    def metrics(self, seq, levels):
+        '''Returns ``(mid, spread, microprice, imbalance, size)`` of a snapshot
+
+        ``imbalance`` is ``(bid size - ask size) / (bid size + ask size)``
+        over the best ``levels`` levels of each side and ``size`` the
+        denominator.
+        '''
+        rows = self.rows
+        depth = self.depth
+        bid_px = self._offset(seq) + 1
+        bid_sz = bid_px + depth
+        ask_px = bid_sz + depth
+        ask_sz = ask_px + depth
+
+        bid, ask = rows[bid_px], rows[ask_px]
+        mid = (bid + ask) / 2.0
+        spread = ask - bid
+        bid_size, ask_size = rows[bid_sz], rows[ask_sz]
+        top = bid_size + ask_size
+        microprice = (bid * ask_size + ask * bid_size) / top if top else mid
+
+        levels = min(levels, depth)
+        bid_total = sum(size for size in rows[bid_sz:bid_sz + levels] if size == size)
+        ask_total = sum(size for size in rows[ask_sz:ask_sz + levels] if size == size)
+        total = bid_total + ask_total
+        imbalance = (bid_total - ask_total) / total if total else _NAN
+        return mid, spread, microprice, imbalance, total
+
+
+class OrderBookRecorder(object):
+    '''Appends order book rows to a gzip file for backtests.
+
+    The file starts with a JSON header line (symbol and depth) followed by
+    the raw rows of an ``OrderBookBuffer`` as native doubles.
+
+    Snapshots are recorded to a file of their own rather than to the store
+    cache (``TimeSeriesCache``): the cache holds bars on a fixed grid and
+    refetches missing blocks from the exchange, while snapshots come at the
+    polling times and exchanges keep no order book history to refetch.
+    '''
+
+    def __init__(self, path, symbol, depth):
+        self.path = path
+        self._file = gzip.open(path, 'wb')
+        header = dict(symbol=symbol, depth=depth, created=time.time())
+        self._file.write((json.dumps(header) + '\n').encode('utf-8'))
+
+    def write(self, row):
+        self._file.write(row.tobytes())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_order_book(path):
+    '''Yields the header and then every row of an ``OrderBookRecorder`` file'''
+    with gzip.open(path, 'rb') as f:
+        header = json.loads(f.readline().decode('utf-8'))
+        yield header
+        size = (1 + 4 * header['depth']) * array('d').itemsize
+        while True:
+            data = f.read(size)
+            if len(data) < size:
+                break
+            row = array('d')
+            row.frombytes(data)
+            yield row
+
+
+class CryptoBookFeed(DataBase):
+    '''Order book (L2) data feed.
+
+    Polls ``fetch_order_book`` at a fixed ``depth`` and delivers one bar per
+    snapshot. ``open``/``high``/``low``/``close`` are the mid price and
+    ``volume`` the size on the best ``imbalance_levels`` levels of both sides.
+    The extra lines are ``mid``, ``spread``, ``microprice`` and
+    ``imbalance``. The levels of the last ``buffer_size`` snapshots are kept
+    in ``self.book`` (an ``OrderBookBuffer``) and returned by
+    ``data.bids(ago)``/``data.asks(ago)``. Preloaded backtests load the whole
+    recording before the first bar, so use a ``buffer_size`` covering it
+    (or ``preload=False``) to read the levels of every bar.
+
+    The store is created from the keyword arguments, like ``CryptoFeed``.
+
+    Params:
+      - ``depth`` (default: ``10``): levels kept per side
+      - ``imbalance_levels`` (default: ``5``): levels summed for ``imbalance``
+      - ``poll_interval`` (default: ``1.0``): minimum seconds between requests
+      - ``fetch_limit`` (default: ``None``): ``limit`` sent to the exchange,
+        ``depth`` if not given (some exchanges only accept a few values)
+      - ``fetch_order_book_params`` (default: ``{}``): exchange specific params
+      - ``buffer_size`` (default: ``1000``): snapshots kept in ``book``
+      - ``record_path`` (default: ``None``): records every snapshot to this
+        file (see ``OrderBookRecorder``, not the store cache)
+      - ``replay_path`` (default: ``None``): delivers the snapshots of a
+        recording instead of polling the exchange, for backtests.
+        ``fromdate``/``todate`` are applied
+    '''
+
+    lines = ('mid', 'spread', 'microprice', 'imbalance', 'seq')
+
+    plotlines = dict(seq=dict(_plotskip=True))
+
+    params = (
+        ('depth', 10),
+        ('imbalance_levels', 5),
+        ('poll_interval', 1.0),
+        ('fetch_limit', None),
+        ('fetch_order_book_params', {}),
+        ('buffer_size', 1000),
+        ('record_path', None),
+        ('replay_path', None),
+        ('debug', False),
+    )
+
+    _store = CryptoStore
+
+    def __init__(self, **kwargs):
+        self.store = self._store(**kwargs)
+        self.book = OrderBookBuffer(self.p.depth, self.p.buffer_size)
+        self._recorder = None
+        self._replay = None
+        self._replay_done = False  # end of the recording reached, no more bars
+        self._last_poll = 0.0
+        if self.p.debug:
+            set_debug(log)
+
+    def start(self):
+        DataBase.start(self)
+        if self.p.replay_path:
+            self._replay_done = False
+            self._replay = read_order_book(self.p.replay_path)
+            header = next(self._replay)
+            if header['depth'] != self.p.depth:
+                raise ValueError('%s was recorded with depth %d, not %d' %
+                                 (self.p.replay_path, header['depth'], self.p.depth))
+            self.put_notification(self.DELAYED)
+        else:
+            if self.p.record_path:
+                self._recorder = OrderBookRecorder(self.p.record_path, self.p.dataname, self.p.depth)
+            self.put_notification(self.LIVE)
+
+    def stop(self):
+        DataBase.stop(self)
+        if self._recorder is not None:
+            self._recorder.close()
+            self._recorder = None
+
+    def bids(self, ago=0):
+        '''Returns the ``(price, size)`` bid levels of the bar ``ago``'''
+        return self.book.bids(int(self.lines.seq[ago]))
+
+    def asks(self, ago=0):
+        '''Returns the ``(price, size)`` ask levels of the bar ``ago``'''
+        return self.book.asks(int(self.lines.seq[ago]))
+
+    def islive(self):
+        return not self.p.replay_path
+
+    def _load(self):
+        if self._replay_done:
+            return False
+        if self._replay is not None:
+            return self._load_replay()
+
+        wait = self._last_poll + self.p.poll_interval - time.time()
+        if wait > 0:
+            return None
+        self._last_poll = time.time()
+
+        book = self.store.fetch_order_book(self.p.dataname, limit=self.p.fetch_limit or self.p.depth,
+                                           params=self.p.fetch_order_book_params)
+        if not book['bids'] or not book['asks']:
+            return None  # one side of the book is empty
+
+        timestamp = book.get('timestamp') or int(self._last_poll * 1000)
+        seq = self.book.append(timestamp, book['bids'], book['asks'])
+        if self._recorder is not None:
+            self._recorder.write(self.book.row(seq))
+        log.debug('order_book', symbol=self.p.dataname, bids=len(book['bids']), asks=len(book['asks']), seq=seq)
+        return self._deliver(seq)
+
+    def _load_replay(self):
+        for row in self._replay:
+            dtime = datetime.utcfromtimestamp(row[0] / 1000.0)
+            if self.p.fromdate and dtime < self.p.fromdate:
+                continue
+            if self.p.todate and dtime > self.p.todate:
+                break
+            return self._deliver(self.book.append_row(row))
+
+        self.put_notification(self.DISCONNECTED)
+        self._replay.close()
+        self._replay = None
+        self._replay_done = True
+        return False
+
+    def _deliver(self, seq):
+        mid, spread, microprice, imbalance, volume = self.book.metrics(seq, self.p.imbalance_levels)
+
+        self.lines.datetime[0] = bt.date2num(datetime.utcfromtimestamp(self.book.timestamp(seq) / 1000.0))
+        self.lines.open[0] = mid
+        self.lines.high[0] = mid
+        self.lines.low[0] = mid
+        self.lines.close[0] = mid
+        self.lines.volume[0] = volume
+        self.lines.mid[0] = mid
+        self.lines.spread[0] = spread
+        self.lines.microprice[0] = microprice
+        self.lines.imbalance[0] = imbalance
+        self.lines.seq[0] = seq
+        return True
@@ -1,12 +1,14 @@
-import collections
-import json
+from concurrent.futures import ThreadPoolExecutor
 
 from backtrader import BrokerBase, OrderBase, Order
-from backtrader.position import Position
 from backtrader.utils.py3 import queue, with_metaclass
 
+from .cryptoledger import CryptoLedger
+from .cryptolog import get_logger, set_debug
 from .cryptostore import CryptoStore
 
+log = get_logger('broker')
+
 
 class CryptoOrder(OrderBase):
     def __init__(self, owner, data, ccxt_order):
@@ -14,6 +16,9 @@ class CryptoOrder(OrderBase):
         self.data = data
         self.ccxt_order = ccxt_order
         self.executed_fills = []
+        self.executed_amount = 0.0  # filled amount already applied to the ledger
+        self.executed_cost = 0.0
+        self.executed_fee = 0.0
         self.ordtype = self.Buy if ccxt_order['side'] == 'buy' else self.Sell
         self.size = float(ccxt_order['amount'])
 
@@ -70,6 +75,28 @@ class CryptoBroker(with_metaclass(MetaCryptoBroker, BrokerBase)):
 
     Added new private_end_point method to allow using any private non-unified end point
 
+    Added a local ledger (see ``CryptoLedger``) updated from every fill, including
+    fees. ``getcash``, ``getvalue`` and ``getposition`` are answered from it. Pass
+    ``reconcile_interval`` (seconds) to periodically compare it with the exchange
+    and ``on_drift`` to be called with any difference found.
+
+    Orders are rounded to the market precision and checked against its limits
+    locally before being sent (see ``MarketIndex``), unless ``check_orders`` is
+    ``False``. The market maker/taker fees are used as commission info for the
+    datas without one set with ``setcommission``/``addcommissioninfo`` (for
+    the data or as default).
+
+    Pass an ``OrderStream`` as ``order_stream`` (e.g. ``CcxtProOrderStream``)
+    to receive the order updates from a private websocket channel instead of
+    polling ``fetch_order`` for every open order in ``next``. The updates
+    received are applied at the start of the next ``next`` call. After a
+    reconnection of the stream the open orders are fetched once over REST, to
+    catch up with the updates missed.
+
+    ``cancel`` sends a single ``cancel_order`` request. ``cancel_orders`` and
+    ``cancel_all_orders`` cancel many orders at once, with the batch
+    endpoints of the exchange or up to ``cancel_workers`` concurrent requests.
+
     '''
 
     order_types = {Order.Market: 'market',
@@ -87,7 +114,8 @@ class CryptoBroker(with_metaclass(MetaCryptoBroker, BrokerBase)):
             'value': 'canceled'}
     }
 
-    def __init__(self, broker_mapping=None, debug=False, **kwargs):
+    def __init__(self, broker_mapping=None, debug=False, reconcile_interval=None, on_drift=None,
+                 check_orders=True, order_stream=None, cancel_workers=8, **kwargs):
         super(CryptoBroker, self).__init__()
 
         if broker_mapping is not None:
@@ -104,10 +132,14 @@ class CryptoBroker(with_metaclass(MetaCryptoBroker, BrokerBase)):
 
         self.currency = self.store.currency
 
-        self.positions = collections.defaultdict(Position)
+        self.ledger = CryptoLedger(self.store, balance=self.store._balance, on_drift=on_drift)
+        self.positions = self.ledger.positions
+        if reconcile_interval:
+            self.ledger.start_reconcile(reconcile_interval)
 
         self.debug = debug
-        self.indent = 4  # For pretty printing dictionaries
+        if debug:
+            set_debug(log)
 
         self.notifs = queue.Queue()  # holds orders which are notified
 
@@ -117,9 +149,24 @@ class CryptoBroker(with_metaclass(MetaCryptoBroker, BrokerBase)):
         self.startingvalue = self.store._value
 
         self.use_order_params = True
+        self.check_orders = check_orders
+        self._market_comminfo = {}  # symbol -> commission info from the market fees
+        self.cancel_workers = cancel_workers
+
+        self.order_stream = order_stream
+        self._stream_updates = queue.Queue()  # ccxt orders received by the stream thread
+        self._resync = False
+
+        self._adopted = self.store.checkpoint is None  # open orders to adopt on the first next()
+        if self.store.checkpoint is not None:
+            self.store.checkpoint.register_broker(self)
+            state = self.store.checkpoint.broker_state()
+            if state:
+                self.ledger.restore_positions(state['positions'])
 
     def get_balance(self):
-        self.store.get_balance()
+        balance = self.store.get_balance()
+        self.ledger.set_balance(balance)
         self.cash = self.store._cash
         self.value = self.store._value
         return self.cash, self.value
@@ -138,16 +185,83 @@ class CryptoBroker(with_metaclass(MetaCryptoBroker, BrokerBase)):
 
     def getcash(self):
         # Get cash seems to always be called before get value
-        # Therefore it makes sense to add getbalance here.
-        # return self.store.getcash(self.currency)
-        self.cash = self.store._cash
+        # Answered from the local ledger to avoid a REST call on every bar
+        self.cash = self.ledger.getcash(self.currency)
         return self.cash
 
     def getvalue(self, datas=None):
-        # return self.store.getvalue(self.currency)
-        self.value = self.store._value
+        self.value = self.ledger.getvalue(self.currency)
         return self.value
 
+    def start(self):
+        super(CryptoBroker, self).start()
+        self.store.get_market_index()  # loaded once here, not while the strategy runs
+        if self.order_stream is not None:
+            self.order_stream.start(self._stream_updates.put, self._stream_reconnected)
+
+    def stop(self):
+        if self.order_stream is not None:
+            self.order_stream.stop()
+        self.ledger.stop_reconcile()
+        if self.store.checkpoint is not None:
+            self.store.checkpoint.save()
+
+    def checkpoint_state(self):
+        orders = [dict(id=o.ccxt_order['id'], symbol=o.data.p.dataname, price=o.price,
+                       executed_fills=o.executed_fills, executed_amount=o.executed_amount,
+                       executed_cost=o.executed_cost, executed_fee=o.executed_fee)
+                  for o in self.open_orders]
+        return dict(open_orders=orders, positions=self.ledger.positions_state())
+
+    def _adopt_orders(self):
+        '''Takes over the orders left open by a previous run
+
+        Orders saved in the checkpoint keep their accounted fills. Other orders
+        open on the exchange are adopted as they are: their previous fills are
+        already part of the fresh balance. Saved orders which are no longer
+        open are fetched once so their last fills and final state are applied;
+        the ones the exchange no longer knows (old closed or canceled orders)
+        are dropped.
+        '''
+        from ccxt.base.errors import InvalidOrder
+        checkpoint = self.store.checkpoint
+        state = checkpoint.broker_state() or {}
+        saved = {o['id']: o for o in state.get('open_orders', [])}
+        known = set(o.ccxt_order['id'] for o in self.open_orders)
+
+        ccxt_orders = []
+        for symbol in set(feed.p.dataname for feed in checkpoint.feeds.values()):
+            ccxt_orders.extend(self.store.fetch_open_orders(symbol=symbol))
+        open_ids = set(o['id'] for o in ccxt_orders)
+        for oid, o in saved.items():
+            if oid not in open_ids and checkpoint.feed_for(o['symbol']) is not None:
+                try:
+                    ccxt_orders.append(self.store.fetch_order(oid, o['symbol']))
+                except InvalidOrder as e:  # OrderNotFound as well
+                    log.warning('saved_order_dropped', order_id=oid, symbol=o['symbol'], error=str(e))
+
+        for ccxt_order in ccxt_orders:
+            if ccxt_order['id'] in known:
+                continue
+            data = checkpoint.feed_for(ccxt_order['symbol'])
+            order = CryptoOrder(None, data, ccxt_order)
+            o = saved.get(ccxt_order['id'])
+            if o is not None:
+                order.price = o['price']
+                order.executed_fills = o['executed_fills']
+                order.executed_amount = o['executed_amount']
+                order.executed_cost = o['executed_cost']
+                order.executed_fee = o['executed_fee']
+            else:
+                order.price = ccxt_order['price']
+                order.executed_fills = [t['id'] for t in ccxt_order.get('trades') or []]
+                order.executed_amount = ccxt_order.get('filled') or 0.0
+                order.executed_cost = ccxt_order.get('cost') or 0.0
+                order.executed_fee = (ccxt_order.get('fee') or {}).get('cost') or 0.0
+            order.accept()
+            self.open_orders.append(order)
+            self.notify(order)
+
     def get_notification(self):
         try:
             return self.notifs.get(False)
@@ -157,66 +271,155 @@ class CryptoBroker(with_metaclass(MetaCryptoBroker, BrokerBase)):
     def notify(self, order):
         self.notifs.put(order)
 
+    def getcommissioninfo(self, data):
+        if data._name in self.comminfo:
+            return self.comminfo[data._name]
+        if self.comminfo[None] is not self.p.commission:
+            return self.comminfo[None]  # default set by the user
+
+        comminfo = self._market_comminfo.get(data.p.dataname)
+        if comminfo is None:
+            info = self.store.get_market_index().get(data.p.dataname)
+            if info is None:
+                return self.comminfo[None]
+            comminfo = self._market_comminfo[data.p.dataname] = info.comminfo()
+        return comminfo
+
     def getposition(self, data, clone=True):
-        # return self.o.getposition(data._dataname, clone=clone)
-        pos = self.positions[data._dataname]
         if clone:
-            pos = pos.clone()
-        return pos
+            return self.ledger.getposition(data._dataname)
+        return self.positions[data._dataname]
+
+    def _execute(self, o_order, dt, amount, price, fee=None):
+        side = 'buy' if o_order.isbuy() else 'sell'
+        size = amount if o_order.isbuy() else -amount
+        o_order.execute(dt, size, price,
+                        0, 0.0, 0.0,
+                        0, 0.0, 0.0,
+                        0.0, 0.0,
+                        0, 0.0)
+        self.ledger.apply_fill(o_order.data.p.dataname, side, amount, price, fee)
+        o_order.executed_amount += amount
+        o_order.executed_cost += amount * price
+        if fee and fee.get('cost'):
+            o_order.executed_fee += fee['cost']
+
+    def _process_fills(self, o_order, ccxt_order):
+        '''Applies the fills of ``ccxt_order`` not seen yet to the order and the ledger'''
+        trades = ccxt_order.get('trades')
+        if trades:
+            filled = 0.0
+            for fill in trades:
+                filled += fill['amount']
+                if fill['id'] not in o_order.executed_fills:
+                    o_order.executed_fills.append(fill['id'])
+                    # skips the trades already applied from a cumulative update
+                    # (e.g. of the order stream) which didn't list them
+                    if filled > o_order.executed_amount + 1e-12:
+                        self._execute(o_order, fill['datetime'], fill['amount'], fill['price'], fill.get('fee'))
+            return
+
+        # The exchange doesn't report the individual trades: derive the new
+        # execution from the cumulative filled amount, cost and fee
+        filled = ccxt_order.get('filled') or 0.0
+        amount = filled - o_order.executed_amount
+        if amount <= 0:
+            return
+
+        cost = ccxt_order.get('cost')
+        if cost:
+            price = (cost - o_order.executed_cost) / amount
+        else:
+            price = ccxt_order.get('average') or ccxt_order.get('price') or o_order.price
+
+        fee = ccxt_order.get('fee')
+        if fee and fee.get('cost'):
+            fee = dict(fee, cost=fee['cost'] - o_order.executed_fee)
+
+        self._execute(o_order, ccxt_order.get('datetime'), amount, price, fee)
 
     def next(self):
-        if self.debug:
-            print('Broker next() called')
-
-        for o_order in list(self.open_orders):
-            oID = o_order.ccxt_order['id']
-
-            # Print debug before fetching so we know which order is giving an
-            # issue if it crashes
-            if self.debug:
-                print('Fetching Order ID: {}'.format(oID))
-
-            # Get the order
-            ccxt_order = self.store.fetch_order(oID, o_order.data.p.dataname)
-
-            # Check for new fills
-            if 'trades' in ccxt_order and ccxt_order['trades'] is not None:
-                for fill in ccxt_order['trades']:
-                    if fill not in o_order.executed_fills:
-                        o_order.execute(fill['datetime'], fill['amount'], fill['price'],
-                                        0, 0.0, 0.0,
-                                        0, 0.0, 0.0,
-                                        0.0, 0.0,
-                                        0, 0.0)
-                        o_order.executed_fills.append(fill['id'])
-
-            if self.debug:
-                print(json.dumps(ccxt_order, indent=self.indent))
-
-            # Check if the order is closed
-            if ccxt_order[self.mappings['closed_order']['key']] == self.mappings['closed_order']['value']:
-                pos = self.getposition(o_order.data, clone=False)
-                pos.update(o_order.size, o_order.price)
-                o_order.completed()
-                self.notify(o_order)
-                self.open_orders.remove(o_order)
-                self.get_balance()
-
-            # Manage case when an order is being Canceled from the Exchange
-            #  from https://github.com/juancols/bt-ccxt-store/
-            if ccxt_order[self.mappings['canceled_order']['key']] == self.mappings['canceled_order']['value']:
-                self.open_orders.remove(o_order)
-                o_order.cancel()
-                self.notify(o_order)
+        if not self._adopted:
+            self._adopted = True
+            self._adopt_orders()
+
+        if self.order_stream is not None:
+            self._apply_stream_updates()
+
+        if self.order_stream is None or self._resync:
+            self._resync = False
+            for o_order in list(self.open_orders):
+                # Get the order
+                ccxt_order = self.store.fetch_order(o_order.ccxt_order['id'], o_order.data.p.dataname)
+                self._update_order(o_order, ccxt_order)
+
+        if self.store.tracer is not None:
+            self.store.tracer.broker_done()
+        if self.store.checkpoint is not None:
+            self.store.checkpoint.maybe_save()
+
+    def _update_order(self, o_order, ccxt_order):
+        # Check for new fills
+        self._process_fills(o_order, ccxt_order)
+
+        # the order dict is only serialized if the event is emitted
+        log.debug('order_update', order=ccxt_order)
+
+        # Check if the order is closed
+        if ccxt_order.get(self.mappings['closed_order']['key']) == self.mappings['closed_order']['value']:
+            o_order.completed()
+            self.notify(o_order)
+            self.open_orders.remove(o_order)
+
+        # Manage case when an order is being Canceled from the Exchange
+        #  from https://github.com/juancols/bt-ccxt-store/
+        elif ccxt_order.get(self.mappings['canceled_order']['key']) == self.mappings['canceled_order']['value']:
+            self.open_orders.remove(o_order)
+            o_order.cancel()
+            self.notify(o_order)
+
+    def _stream_reconnected(self):
+        # called from the stream thread: the REST resync runs in the next next()
+        self._resync = True
+
+    def _apply_stream_updates(self):
+        '''Applies the order updates received from the order stream since the last call'''
+        if self.order_stream.error is not None:
+            raise self.order_stream.error
+        if self._stream_updates.empty():
+            return
+        by_id = {o.ccxt_order['id']: o for o in self.open_orders}
+        while True:
+            try:
+                ccxt_order = self._stream_updates.get(False)
+            except queue.Empty:
+                break
+            o_order = by_id.get(ccxt_order['id'])
+            if o_order is None or not o_order.alive():
+                continue  # not ours, or already done
+            self._update_order(o_order, ccxt_order)
 
     def _submit(self, owner, data, exectype, side, amount, price, params):
+        from ccxt.base.errors import InsufficientFunds, InvalidOrder
         if amount == 0 or price == 0:
         # do not allow failing orders
             return None
         order_type = self.order_types.get(exectype) if exectype else 'market'
+        if self.check_orders:
+            try:
+                amount, price = self.store.get_market_index().check(data.p.dataname, amount, price,
+                                                                    ref_price=data.close[0])
+            except InvalidOrder as e:
+                # rejected locally: saves the round trip and the rate limit
+                log.info('order_rejected', symbol=data.p.dataname, side=side, amount=amount, price=price,
+                         error=str(e))
+                return None
         created = int(data.datetime.datetime(0).timestamp()*1000)
         # Extract CCXT specific params if passed to the order
         params = params['params'] if 'params' in params else params
+        tracer = self.store.tracer
+        if tracer is not None:
+            tracer.order_sent(data.p.dataname)
         if not self.use_order_params:
             ret_ord = self.store.create_order(symbol=data.p.dataname, order_type=order_type, side=side,
                                               amount=amount, price=price, params={})
@@ -226,6 +429,9 @@ class CryptoBroker(with_metaclass(MetaCryptoBroker, BrokerBase)):
                 params['created'] = created  # Add timestamp of order creation for backtesting
                 ret_ord = self.store.create_order(symbol=data.p.dataname, order_type=order_type, side=side,
                                                   amount=amount, price=price, params=params)
+            except (InvalidOrder, InsufficientFunds):
+                # the order itself was rejected, not its params
+                return None
             except:
                 # save some API calls after failure
                 self.use_order_params = False
@@ -235,6 +441,9 @@ class CryptoBroker(with_metaclass(MetaCryptoBroker, BrokerBase)):
         if ret_ord is None:
             return None
 
+        if tracer is not None:
+            tracer.order_acked(data.p.dataname, ret_ord['id'])
+
         _order = self.store.fetch_order(ret_ord['id'], data.p.dataname)
 
         order = CryptoOrder(owner, data, _order)
@@ -261,35 +470,117 @@ class CryptoBroker(with_metaclass(MetaCryptoBroker, BrokerBase)):
         return self._submit(owner, data, exectype, 'sell', size, price, kwargs)
 
     def cancel(self, order):
+        '''Cancels ``order`` with a single ``cancel_order`` request
 
-        oID = order.ccxt_order['id']
-
-        if self.debug:
-            print('Broker cancel() called')
-            print('Fetching Order ID: {}'.format(oID))
-
-        # check first if the order has already been filled otherwise an error
-        # might be raised if we try to cancel an order that is not open.
-        ccxt_order = self.store.fetch_order(oID, order.data.p.dataname)
-
-        if self.debug:
-            print(json.dumps(ccxt_order, indent=self.indent))
-
-        if ccxt_order[self.mappings['closed_order']['key']] == self.mappings['closed_order']['value']:
+        The request is sent without checking the order state first. If the
+        exchange answers that the order is not found (or no longer
+        cancelable), the order is fetched once to apply its final fills and
+        state; an order the exchange does not know at all is canceled.
+        '''
+        if not order.alive():
             return order
 
-        ccxt_order = self.store.cancel_order(oID, order.data.p.dataname)
+        oID = order.ccxt_order['id']
+        log.debug('cancel', order_id=oID)
+        self._apply_cancel(order, self._cancel_requests([(oID, order.data.p.dataname)])[oID])
+        return order
+
+    def cancel_orders(self, orders):
+        '''Cancels several orders at once
 
-        if self.debug:
-            print(json.dumps(ccxt_order, indent=self.indent))
-            print('Value Received: {}'.format(ccxt_order[self.mappings['canceled_order']['key']]))
-            print('Value Expected: {}'.format(self.mappings['canceled_order']['value']))
+        Uses the ``cancelOrders`` batch endpoint of the exchange (one request
+        per symbol) if it has one, concurrent ``cancel_order`` requests
+        (``cancel_workers`` at a time) otherwise. Orders left out of a batch
+        reply are updated by the next poll (or order stream update).
+        Returns the orders.
+        '''
+        orders = [o for o in orders if o.alive()]
+        if not orders:
+            return orders
+
+        if self.store.exchange.has.get('cancelOrders'):
+            by_symbol = {}
+            for o in orders:
+                by_symbol.setdefault(o.data.p.dataname, []).append(o)
+            for symbol, symbol_orders in by_symbol.items():
+                replies = self.store.cancel_orders([o.ccxt_order['id'] for o in symbol_orders], symbol)
+                self._apply_cancel_replies(symbol_orders, replies)
+            return orders
+
+        replies = self._cancel_requests([(o.ccxt_order['id'], o.data.p.dataname) for o in orders])
+        error = None
+        for o in orders:
+            try:
+                self._apply_cancel(o, replies[o.ccxt_order['id']])
+            except Exception as e:  # the other orders are still applied
+                error = error or e
+        if error is not None:
+            raise error
+        return orders
+
+    def cancel_all_orders(self, symbol=None):
+        '''Cancels every open order of the account for ``symbol`` (all symbols if ``None``)
+
+        Orders not placed through this broker are canceled as well. Uses the
+        ``cancelAllOrders`` endpoint if the exchange has one, otherwise the
+        open orders are fetched and canceled concurrently. Returns the orders
+        of this broker which were open.
+        '''
+        orders = [o for o in self.open_orders if symbol is None or o.data.p.dataname == symbol]
+
+        if self.store.exchange.has.get('cancelAllOrders'):
+            symbols = [symbol] if symbol is not None else sorted(set(o.data.p.dataname for o in orders)) or [None]
+            for s in symbols:
+                self._apply_cancel_replies(orders, self.store.cancel_all_orders(s))
+            return orders
+
+        ccxt_orders = self.store.fetch_open_orders(symbol=symbol)
+        replies = self._cancel_requests([(o['id'], o['symbol']) for o in ccxt_orders])
+        mine = dict((o.ccxt_order['id'], o) for o in orders)
+        for oid, reply in replies.items():
+            if oid in mine:
+                self._apply_cancel(mine[oid], reply)
+        return orders
+
+    def _cancel_requests(self, requests):
+        '''Sends the ``(order_id, symbol)`` cancel requests, concurrently if there are several
+
+        Returns a dict of the reply (or the exception raised) by order id.
+        '''
+        def cancel(request):
+            try:
+                return self.store.cancel_order(*request)
+            except Exception as e:
+                return e
 
-        if ccxt_order[self.mappings['canceled_order']['key']] == self.mappings['canceled_order']['value']:
-            self.open_orders.remove(order)
-            order.cancel()
-            self.notify(order)
-        return order
+        if len(requests) == 1:
+            results = [cancel(requests[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=max(1, min(self.cancel_workers, len(requests)))) as pool:
+                results = list(pool.map(cancel, requests))
+        return dict((oid, result) for (oid, _), result in zip(requests, results))
+
+    def _apply_cancel(self, order, reply):
+        from ccxt.base.errors import InvalidOrder, OrderNotFound
+        if isinstance(reply, InvalidOrder):  # OrderNotFound as well
+            # already filled or canceled: fetch the final state once
+            log.info('cancel_not_found', order_id=order.ccxt_order['id'], error=str(reply))
+            try:
+                reply = self.store.fetch_order(order.ccxt_order['id'], order.data.p.dataname)
+            except OrderNotFound:
+                reply = {self.mappings['canceled_order']['key']: self.mappings['canceled_order']['value']}
+        elif isinstance(reply, Exception):
+            raise reply
+
+        if order.alive():
+            self._update_order(order, reply)
+
+    def _apply_cancel_replies(self, orders, replies):
+        by_id = dict((o.ccxt_order['id'], o) for o in orders)
+        for reply in replies if isinstance(replies, list) else []:
+            order = by_id.get(reply.get('id')) if isinstance(reply, dict) else None
+            if order is not None and order.alive():
+                self._update_order(order, reply)
 
     def modify_order(self, order_id, symbol, *args):
         return self.store.edit_order(order_id=order_id, symbol=symbol, *args)
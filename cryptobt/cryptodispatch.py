@@ -0,0 +1,209 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from .cryptolog import get_logger, set_debug
+
+log = get_logger('dispatch')
+
+
+class OrderDispatcher(object):
+    '''Non-blocking order interceptor.
+
+    Pass an instance as ``order_interceptor`` to ``CryptoStore``. Intercepted
+    orders are put on a bounded queue and delivered to ``handler`` by a
+    background worker, so slow consumers (message brokers, webhooks ...) stay
+    off the Cerebro thread.
+
+    Params:
+      - ``handler``: callable receiving a list of order messages (dicts with
+        ``symbol``, ``order_type``, ``side``, ``amount``, ``price``,
+        ``params`` and ``ts``, the epoch time it was intercepted)
+      - ``maxsize`` (default: ``1000``): capacity of the queue
+      - ``batch_size`` (default: ``1``): maximum number of messages per
+        ``handler`` call
+      - ``batch_timeout`` (default: ``0.0``): seconds to wait for a batch to
+        fill up before delivering it
+      - ``backpressure`` (default: ``'block'``): what to do when the queue is
+        full. ``'block'`` waits for room, ``'drop'`` discards the message and
+        ``'spill'`` appends it to ``spill_path`` as a JSON line. Once
+        spilling, every message goes to the file until it is drained, in
+        order, whenever the queue is empty, so messages are delivered in the
+        order they were put.
+      - ``spill_path`` (default: ``None``): file used by the ``'spill'`` policy
+      - ``debug`` (default: ``False``): print the delivery failures (logged as
+        ``dispatch_failed`` warnings, see ``cryptolog``)
+    '''
+
+    BACKPRESSURE = ('block', 'drop', 'spill')
+
+    def __init__(self, handler, maxsize=1000, batch_size=1, batch_timeout=0.0,
+                 backpressure='block', spill_path=None, debug=False):
+        if backpressure not in self.BACKPRESSURE:
+            raise ValueError("backpressure must be one of %s" % (self.BACKPRESSURE,))
+        if backpressure == 'spill' and not spill_path:
+            raise ValueError("spill_path is required for the 'spill' backpressure")
+
+        self.handler = handler
+        self.maxsize = maxsize
+        self.batch_size = max(1, batch_size)
+        self.batch_timeout = batch_timeout
+        self.backpressure = backpressure
+        self.spill_path = spill_path
+        self.debug = debug
+        if debug:
+            set_debug(log)
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._spill_lock = threading.Lock()
+        self._closed = False
+        self._busy = False
+        self._spilling = False  # messages are waiting in the spill file
+
+        self._metrics = dict(enqueued=0, delivered=0, dropped=0, spilled=0, failed=0,
+                             batches=0, latency_sum=0.0, latency_max=0.0)
+
+        if backpressure == 'spill':
+            self._unspill()  # left over from a previous run
+
+        self._worker = threading.Thread(target=self._run, name='cryptobt-dispatch', daemon=True)
+        self._worker.start()
+
+    def __call__(self, symbol, order_type, side, amount, price, params):
+        message = dict(symbol=symbol, order_type=order_type, side=side, amount=amount,
+                       price=price, params=params, ts=time.time())
+        self.put(message)
+
+    def put(self, message):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("OrderDispatcher is closed")
+
+            if self._spilling:
+                # Behind the spilled messages, to keep them in order
+                self._spill(message)
+                self._metrics['spilled'] += 1
+                return
+
+            if len(self._queue) >= self.maxsize:
+                if self.backpressure == 'drop':
+                    self._metrics['dropped'] += 1
+                    return
+                elif self.backpressure == 'spill':
+                    self._spill(message)
+                    self._spilling = True
+                    self._metrics['spilled'] += 1
+                    return
+                while len(self._queue) >= self.maxsize:
+                    self._cond.wait()
+
+            self._queue.append(message)
+            self._metrics['enqueued'] += 1
+            self._cond.notify_all()
+
+    def _spill(self, message):
+        with self._spill_lock:
+            with open(self.spill_path, 'a') as f:
+                f.write(json.dumps(message, default=str) + '\n')
+
+    def _unspill(self):
+        '''Moves up to ``maxsize`` spilled messages, the oldest first, into the queue once it is empty'''
+        with self._cond, self._spill_lock:
+            if self._queue or not self.spill_path or not os.path.isfile(self.spill_path):
+                return
+            with open(self.spill_path, 'r') as f:
+                lines = [line for line in f if line.strip()]
+
+            messages = [json.loads(line) for line in lines[:self.maxsize]]
+            rest = lines[self.maxsize:]
+            if rest:
+                with open(self.spill_path, 'w') as f:
+                    f.writelines(rest)
+            else:
+                os.remove(self.spill_path)
+            self._spilling = bool(rest)
+
+            self._queue.extend(messages)
+            self._metrics['enqueued'] += len(messages)
+            self._cond.notify_all()
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue and not self._closed:
+                self._cond.wait()
+
+            if self.batch_timeout and len(self._queue) < self.batch_size and not self._closed:
+                deadline = time.time() + self.batch_timeout
+                while len(self._queue) < self.batch_size and not self._closed:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+            batch = []
+            while self._queue and len(batch) < self.batch_size:
+                batch.append(self._queue.popleft())
+            self._busy = bool(batch)
+            self._cond.notify_all()
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                if self._closed:
+                    return
+                continue
+
+            try:
+                self.handler(batch)
+            except Exception as e:
+                with self._cond:
+                    self._metrics['failed'] += len(batch)
+                log.warning('dispatch_failed', messages=len(batch), error=e)
+            else:
+                now = time.time()
+                with self._cond:
+                    self._metrics['delivered'] += len(batch)
+                    self._metrics['batches'] += 1
+                    for message in batch:
+                        latency = now - message['ts']
+                        self._metrics['latency_sum'] += latency
+                        self._metrics['latency_max'] = max(self._metrics['latency_max'], latency)
+
+            if self.backpressure == 'spill':
+                self._unspill()
+
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        '''Waits until all queued messages have been delivered'''
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._queue or self._busy:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        '''Delivers the pending messages and stops the worker'''
+        self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._worker.join(timeout)
+
+    def metrics(self):
+        '''Returns a snapshot of the delivery counters'''
+        with self._cond:
+            metrics = dict(self._metrics, pending=len(self._queue))
+        delivered = metrics['delivered']
+        metrics['latency_avg'] = metrics['latency_sum'] / delivered if delivered else 0.0
+        return metrics
@@ -6,8 +6,14 @@ import backtrader as bt
 from backtrader.feed import DataBase
 from backtrader.utils.py3 import with_metaclass
 
+from .cryptoarrow import scan_ohlcv
+from .cryptolog import get_logger, set_debug
+from .cryptoohlcv import OHLCVStats, align_asof, fill_gaps, validate_ohlcv
+from .cryptoprefetch import OHLCVPrefetcher
 from .cryptostore import CryptoStore
 
+log = get_logger('feed')
+
 
 class MetaCryptoFeed(DataBase.__class__):
     def __init__(cls, name, bases, dct):
@@ -31,6 +37,51 @@ class CryptoFeed(with_metaclass(MetaCryptoFeed, DataBase)):
       - ``backfill_start`` (default: ``True``)
         Perform backfilling at the start. The maximum possible historical data
         will be fetched in a single request.
+      - ``ohlcv_limit`` (default: ``None``)
+        Candles per request. By default the largest page the exchange supports
+        is used (see ``CryptoStore.get_ohlcv_limit``); a given value is capped to it.
+      - ``gap_fill`` (default: ``None``)
+        Every fetched or cached window is validated before being queued: rows
+        with missing values and duplicates are dropped, rows are sorted and
+        missing bars are counted in ``ohlcv_stats``. Set to ``'ffill'`` to
+        fill missing bars with flat zero-volume bars or to ``'refetch'`` to
+        request them once more from the exchange.
+      - ``derivatives`` (default: ``()``)
+        Derivatives series to align to the bars, any of ``'funding_rate'``,
+        ``'mark_price'``, ``'index_price'`` (delivered in the lines of the
+        same name) and ``'open_interest'`` (delivered in ``openinterest``).
+        They are fetched from the ccxt history endpoints with the candles,
+        one request per series and batch, and cached with them. Funding rates
+        and open interest hold their last value until the next one, and are
+        only requested again once their own period has rolled over. Open
+        interest is requested at the closest period the exchanges support
+        (see ``CryptoStore.get_open_interest_period``).
+      - ``source`` (default: ``None``)
+        Another ``CryptoFeed`` of the same symbol at a finer granularity. The
+        feed then makes no requests of its own to follow the market: its bars
+        are built from the bars of ``source`` as they are fetched and closed
+        on the exchange bar boundaries (as soon as the last ``source`` bar of
+        the period arrives). Bars before the first complete period are
+        backfilled from ``fromdate`` with the candles of its own granularity
+        (from the cache when ``todate`` is set). ``derivatives`` are not
+        supported on such feeds.
+      - ``prefetch`` (default: ``0``)
+        Low-water mark in bars. If set, the next page (or cache block) is
+        fetched in a background thread as soon as fewer bars are queued, so
+        network round trips overlap with the strategy (run Cerebro with
+        ``preload=False`` for backtests). Live feeds keep polling in the
+        background. Not used on tick feeds and on feeds with derived feeds
+        (see ``source``).
+      - ``arrow_dataset`` (default: ``None``)
+        Arrow/Parquet dataset (path or ``pyarrow.dataset.Dataset``, see
+        ``cryptoarrow``) the bars from ``fromdate`` to ``todate`` are read
+        from instead of the exchange or the cache. Only the OHLCV columns of
+        the feed symbol and granularity in that range are scanned. The
+        dataset must be sorted by time. Live feeds continue from the
+        exchange after its last bar.
+      - ``arrow_format`` (default: ``'parquet'``)
+        Format of ``arrow_dataset`` when it is a path (``'ipc'`` for Arrow
+        files)
 
     Changes From Ed's pacakge
 
@@ -41,12 +92,20 @@ class CryptoFeed(with_metaclass(MetaCryptoFeed, DataBase)):
 
     """
 
+    lines = ('funding_rate', 'mark_price', 'index_price')
+
     params = (
         ('historical', False),  # only historical download
         ('backfill_start', False),  # do backfilling at the start
         ('fetch_ohlcv_params', {}),
-        ('ohlcv_limit', 20),
+        ('ohlcv_limit', None),
         ('drop_newest', False),
+        ('gap_fill', None),
+        ('derivatives', ()),
+        ('source', None),
+        ('prefetch', 0),
+        ('arrow_dataset', None),
+        ('arrow_format', 'parquet'),
         ('debug', False)
     )
 
@@ -55,6 +114,9 @@ class CryptoFeed(with_metaclass(MetaCryptoFeed, DataBase)):
     # States for the Finite State Machine in _load
     _ST_LIVE, _ST_HISTORBACK, _ST_OVER = range(3)
 
+    # ccxt weekly candles open on Mondays, the epoch was a Thursday
+    _WEEK_OFFSET = 4 * 24 * 60 * 60 * 1000
+
     # def __init__(self, exchange, symbol, ohlcv_limit=None, config={}, retries=5):
     def __init__(self, **kwargs):
         # self.store = CryptoStore(exchange, config, retries)
@@ -62,24 +124,216 @@ class CryptoFeed(with_metaclass(MetaCryptoFeed, DataBase)):
         self._data = deque()  # data queue for price data
         self._last_id = ''  # last processed trade id for ohlcv
         self._last_ts = 0  # last processed timestamp for ohlcv
+        self._last_close = None  # close of the last processed bar, used to forward fill gaps
         self._ts_delta = None  # timestamp delta for ohlcv
+        self._recent = None  # last delivered bars, kept for the checkpoint
+        self.ohlcv_stats = OHLCVStats()
+        self._derivative_lines = []  # lines of the derivatives series, in the order of the params
+        self._derivative_held = {}  # series -> (last point, when the next one is due)
+        self._derived = []  # feeds built from the bars of this one
+        self._bucket = None  # period being built from the source bars
+        self._bucket_ms = None  # (duration, offset) of the periods
+        self._synced = False  # set once a period has started on its boundary
+        self._prefetcher = None
+        self._prefetch_pages = None  # historical window fetched by the prefetcher
+        if self.p.source is not None:
+            self.p.source._derived.append(self)
+        if self.p.debug:
+            set_debug(log)
 
     def start(self, ):
         DataBase.start(self)
 
-        if self.p.fromdate:
+        self._derivative_lines = []
+        self._derivative_held = {}
+        for series in self.p.derivatives:
+            if series not in self.store.DERIVATIVE_SERIES:
+                raise ValueError("Unknown derivatives series '%s'" % series)
+            name = 'openinterest' if series == 'open_interest' else series
+            self._derivative_lines.append(getattr(self.lines, name))
+
+        if self.p.source is not None:
+            return self._start_derived()
+
+        restored = False
+        checkpoint = self.store.checkpoint
+        if checkpoint is not None and not self.p.historical and self._timeframe != bt.TimeFrame.Ticks:
+            key = self._checkpoint_key()
+            checkpoint.register_feed(key, self)
+            self._recent = deque(maxlen=checkpoint.bars)
+            restored = self._restore_checkpoint(checkpoint.feed_state(key))
+
+        if self.p.fromdate or restored:
+            # The restored bars were already processed by the previous run:
+            # they are delivered as backfill, before the feed goes LIVE
             self._state = self._ST_HISTORBACK
             self.put_notification(self.DELAYED)
-            self._fetch_ohlcv(self.p.fromdate)
+            # After a restore only the bars since the last saved one are missing
+            pages = self._fetch_pages(None if restored else self.p.fromdate)
+            if self._prefetching():
+                self._prefetch_pages = pages  # fetched in the background from the first _load
+            else:
+                for _ in pages:
+                    pass
 
         else:
             self._state = self._ST_LIVE
             self.put_notification(self.LIVE)
 
+    def _start_derived(self):
+        source = self.p.source
+        if source.p.dataname != self.p.dataname or source._timeframe == bt.TimeFrame.Ticks:
+            raise ValueError('source must be an OHLCV feed of %s' % self.p.dataname)
+        if self.p.derivatives:
+            raise ValueError('derivatives are not supported on feeds with a source')
+        duration, offset = self._bucket_duration()
+        source_duration = self.store.get_timeframe_ms(
+            self.store.get_granularity(source._timeframe, source._compression))
+        if not source_duration or duration % source_duration:
+            raise ValueError('%s bars cannot be built from %s bars' % (
+                self.store.get_granularity(self._timeframe, self._compression),
+                self.store.get_granularity(source._timeframe, source._compression)))
+
+        if self.p.fromdate:
+            self._backfill_derived()
+        if source.p.historical:
+            self._state = self._ST_HISTORBACK
+            self.put_notification(self.DELAYED)
+        else:
+            self._state = self._ST_LIVE
+            self.put_notification(self.LIVE)
+
+    def _bucket_duration(self):
+        if self._bucket_ms is None:
+            granularity = self.store.get_granularity(self._timeframe, self._compression)
+            duration = self.store.get_timeframe_ms(granularity)
+            if duration is None:
+                raise ValueError('%s bars cannot be built from a source feed' % granularity)
+            self._bucket_ms = (duration, self._WEEK_OFFSET if granularity.endswith('w') else 0)
+        return self._bucket_ms
+
+    def _backfill_derived(self):
+        '''Queues the closed candles of the feed granularity from ``fromdate``'''
+        granularity = self.store.get_granularity(self._timeframe, self._compression)
+        duration, _ = self._bucket_duration()
+        self._ts_delta = duration
+        now = int(time.time() * 1000)
+
+        if self.store.cache is not None and self.p.todate:
+            data = self.store.query_cache(self.p.dataname, granularity, self.p.fromdate, self.p.todate)
+        else:
+            since = int((self.p.fromdate - datetime(1970, 1, 1)).total_seconds() * 1000)
+            end = int((self.p.todate - datetime(1970, 1, 1)).total_seconds() * 1000) if self.p.todate else now
+            data = self.store.fetch_ohlcv_pages(self.p.dataname, granularity, since, (end - since) // duration + 1,
+                                                params=self.p.fetch_ohlcv_params)
+        data = [ohlcv for ohlcv in self._validate(data, granularity) if ohlcv[0] + duration <= now]
+
+        # Merge with the bars already built from the source, candles first
+        bars = {ohlcv[0]: ohlcv for ohlcv in self._data}
+        bars.update((ohlcv[0], ohlcv) for ohlcv in data)
+        self._data = deque(bars[ts] for ts in sorted(bars))
+        if self._data:
+            self._last_ts = max(self._last_ts, self._data[-1][0])
+            self._last_close = self._data[-1][4]
+
+    def _fan_out(self, ohlcv):
+        for feed in self._derived:
+            feed._aggregate(ohlcv, self._ts_delta)
+
+    def _aggregate(self, ohlcv, source_duration):
+        '''Adds a bar of the source feed to the period being built'''
+        duration, offset = self._bucket_duration()
+        tstamp = ohlcv[0]
+        start = (tstamp - offset) // duration * duration + offset
+
+        bucket = self._bucket
+        if bucket is not None and bucket[0] != start:
+            self._close_bucket()  # the source skipped the end of the previous period
+            bucket = None
+
+        if bucket is None:
+            if not self._synced and tstamp != start:
+                return  # only part of the first period is available
+            self._synced = True
+            self._bucket = [start, ohlcv[1], ohlcv[2], ohlcv[3], ohlcv[4], ohlcv[5]]
+        else:
+            bucket[2] = max(bucket[2], ohlcv[2])
+            bucket[3] = min(bucket[3], ohlcv[3])
+            bucket[4] = ohlcv[4]
+            bucket[5] += ohlcv[5]
+
+        if tstamp + (source_duration or 0) >= start + duration:
+            self._close_bucket()
+
+    def _close_bucket(self):
+        bucket, self._bucket = self._bucket, None
+        if bucket[0] > self._last_ts:
+            self._data.append(bucket)
+            self._last_ts = bucket[0]
+            self._last_close = bucket[4]
+
+    def _prefetching(self):
+        return bool(self.p.prefetch) and not self._derived and self._timeframe != bt.TimeFrame.Ticks
+
+    def stop(self):
+        DataBase.stop(self)
+        if self._prefetcher is not None:
+            self._prefetcher.stop()
+            self._prefetcher = None
+        if self._recent is not None:
+            self.store.checkpoint.save()
+
+    def _checkpoint_key(self):
+        granularity = self.store.get_granularity(self._timeframe, self._compression)
+        return '%s/%s' % (self.p.dataname, granularity)
+
+    def checkpoint_state(self):
+        return dict(last_ts=self._last_ts, last_id=self._last_id, ts_delta=self._ts_delta,
+                    bars=list(self._recent))
+
+    def _restore_checkpoint(self, state):
+        '''Queues the saved bars again. Returns ``False`` if they don't cover ``fromdate``'''
+        if not state or not state['bars']:
+            return False
+
+        bars = state['bars']
+        if self.p.fromdate:
+            since = int((self.p.fromdate - datetime(1970, 1, 1)).total_seconds() * 1000)
+            if bars[0][0] > since + (state['ts_delta'] or 0):
+                return False  # the saved window starts too late
+            bars = [bar for bar in bars if bar[0] >= since]
+            if not bars:
+                return False
+
+        self._data.extend(bars)
+        self._last_ts = bars[-1][0]
+        self._last_close = bars[-1][4]
+        self._last_id = state['last_id']
+        self._ts_delta = state['ts_delta']
+        for ohlcv in bars:
+            self._fan_out(ohlcv)
+        return True
+
     def _load(self):
         if self._state == self._ST_OVER:
             return False
 
+        if self.p.source is not None:
+            ret = self._load_ohlcv()
+            if not ret and self.p.source.p.historical:
+                # the source fetches its whole history on start
+                self._state = self._ST_OVER
+                self.put_notification(self.DISCONNECTED)
+                return False
+            return ret
+
+        if self._recent is not None:
+            self.store.checkpoint.maybe_save()
+
+        if self._prefetcher is None and self._prefetching():
+            self._prefetcher = OHLCVPrefetcher(self, self._prefetch_pages, not self.p.historical, self.p.prefetch)
+            self._prefetch_pages = None
+
         while True:
             if self._state == self._ST_LIVE:
                 if self._timeframe == bt.TimeFrame.Ticks:
@@ -90,17 +344,20 @@ class CryptoFeed(with_metaclass(MetaCryptoFeed, DataBase)):
                         # INFO: Only call _fetch_ohlcv when self._data is fully consumed as it will cause execution
                         #       inefficiency due to network latency. Furthermore it is extremely inefficiency to fetch
                         #       an amount of bars but only load one bar at a given time.
-                        self._fetch_ohlcv()
-                    ret = self._load_ohlcv()
-                    if self.p.debug:
-                        print('----     LOAD    ----')
-                        print('{} Load OHLCV Returning: {}'.format(datetime.utcnow(), ret))
-                    return ret
+                        if self._prefetcher is None:
+                            self._fetch_ohlcv()
+                        elif self._prefetcher.error is not None:
+                            raise self._prefetcher.error
+                    return self._load_ohlcv()
 
             elif self._state == self._ST_HISTORBACK:
                 ret = self._load_ohlcv()
                 if ret:
                     return ret
+                elif self._prefetcher is not None and not self._prefetcher.backfilled:
+                    self._prefetcher.wait()  # next page still on its way
+                elif self._data:
+                    continue  # queued after the check above, before the end of the window
                 else:
                     # End of historical data
                     if self.p.historical:  # only historical
@@ -113,15 +370,43 @@ class CryptoFeed(with_metaclass(MetaCryptoFeed, DataBase)):
 
     def _fetch_ohlcv(self, fromdate=None):
         """Fetch OHLCV data into self._data queue"""
+        for _ in self._fetch_pages(fromdate):
+            pass
+
+    def _fetch_pages(self, fromdate=None):
+        '''Fetches OHLCV data into the ``self._data`` queue, yielding after every page or cache block'''
         granularity = self.store.get_granularity(self._timeframe, self._compression)
-        if self.store.cache is not None and self.p.todate:
-            print("Loading from cache", self.p.dataname, granularity, fromdate, self.p.todate)
-            data = sorted(self.store.cache.query(self.p.dataname, granularity, fromdate, self.p.todate))
-            if self.p.drop_newest:
-                del data[-1]
-            if len(data) > 0:
-                self._data.extend(data)
-                self._last_ts = data[-1][0]
+
+        if self._ts_delta is None:
+            # Exact bar spacing from the granularity. Calendar based ones
+            # (months, years) are still learnt from the data below
+            self._ts_delta = self.store.get_timeframe_ms(granularity)
+
+        blocks = None
+        cached = False
+        if self.p.arrow_dataset is not None and fromdate is not None:
+            # archived bars are complete: drop_newest doesn't apply
+            blocks = ((data, False) for data in scan_ohlcv(self.p.arrow_dataset, self.p.dataname, granularity,
+                                                           fromdate, self.p.todate, format=self.p.arrow_format))
+        elif self.store.cache is not None and self.p.todate:
+            log.info('cache_load', symbol=self.p.dataname, granularity=granularity, fromdate=fromdate,
+                     todate=self.p.todate)
+            blocks = self.store.iter_cache_blocks(self.p.dataname, granularity, fromdate, self.p.todate)
+            cached = True
+
+        if blocks is not None:
+            for data, last in blocks:
+                data = self._validate(data, granularity)
+                if self.p.drop_newest and data and last:
+                    del data[-1]
+                self._attach_derivatives(data, granularity, cached=cached)
+                if len(data) > 0:
+                    self._data.extend(data)
+                    for ohlcv in data:
+                        self._fan_out(ohlcv)
+                    self._last_ts = data[-1][0]
+                    self._last_close = data[-1][4]
+                yield
         else:
             till = int((self.p.todate - datetime(1970, 1, 1)).total_seconds() * 1000) if self.p.todate else None
 
@@ -136,45 +421,33 @@ class CryptoFeed(with_metaclass(MetaCryptoFeed, DataBase)):
                 else:
                     since = None
 
-            limit = self.p.ohlcv_limit
+            limit = self.store.get_ohlcv_limit(self.p.dataname, self.p.ohlcv_limit)
+            short = None  # last short page, until the next one tells whether it was truncated
 
             while True:
-                dlen = len(self._data)
-
-                if self.p.debug:
-                    # TESTING
-                    since_dt = datetime.utcfromtimestamp(since // 1000) if since is not None else 'NA'
-                    print('---- NEW REQUEST ----')
-                    print('{} - Requesting: Since TS:{} Since date:{} granularity:{}, limit:{}, params:{}'.format(
-                        datetime.utcnow(), since, since_dt, granularity, limit, self.p.fetch_ohlcv_params))
-                    data = sorted(self.store.fetch_ohlcv(self.p.dataname, timeframe=granularity,
-                                                         since=since, limit=limit, params=self.p.fetch_ohlcv_params))
-                    try:
-                        for i, ohlcv in enumerate(data):
-                            tstamp, open_, high, low, close, volume = ohlcv
-                            print('{} - Data {}: {} - TS {} Time {}'.format(datetime.utcnow(), i,
-                                                                            datetime.utcfromtimestamp(tstamp // 1000),
-                                                                            tstamp, (time.time() * 1000)))
-                            # ------------------------------------------------------------------
-                    except IndexError:
-                        print('Index Error: Data = {}'.format(data))
-                    print('---- REQUEST END ----')
-                else:
+                added = 0
+                requested = limit
+
+                data = self.store.fetch_ohlcv(self.p.dataname, timeframe=granularity,
+                                              since=since, limit=requested, params=self.p.fetch_ohlcv_params)
 
-                    data = sorted(self.store.fetch_ohlcv(self.p.dataname, timeframe=granularity,
-                                                         since=since, limit=limit, params=self.p.fetch_ohlcv_params))
+                received = len(data)
+                if short is not None and self.store.ohlcv_truncated(short, data):
+                    limit = self.store.shrink_ohlcv_limit(self.p.dataname, short[0])
+                short = None
+                data = self._validate(data, granularity)
 
                 # Check to see if dropping the latest candle will help with
                 # exchanges which return partial data
                 if self.p.drop_newest and len(data) > 0:
                     del data[-1]
+                self._attach_derivatives(data, granularity)
+
+                tracer = self.store.tracer if self._state == self._ST_LIVE else None
 
                 prev_tstamp = None
                 tstamp = None
                 for ohlcv in data:
-                    if None in ohlcv:
-                        continue
-
                     tstamp = ohlcv[0]
 
                     if prev_tstamp is not None and self._ts_delta is None:
@@ -186,10 +459,14 @@ class CryptoFeed(with_metaclass(MetaCryptoFeed, DataBase)):
                     #    continue
 
                     if tstamp > self._last_ts:
-                        if self.p.debug:
-                            print('Adding: {}'.format(ohlcv))
                         self._data.append(ohlcv)
+                        added += 1
+                        self._fan_out(ohlcv)
                         self._last_ts = tstamp
+                        self._last_close = ohlcv[4]
+                        if tracer is not None:
+                            close_time = (tstamp + self._granularity_ms(granularity)) / 1000.0
+                            tracer.bar_received(self.p.dataname, tstamp, close_time)
 
                     if till and tstamp >= till:
                         break
@@ -197,16 +474,95 @@ class CryptoFeed(with_metaclass(MetaCryptoFeed, DataBase)):
                     if prev_tstamp is None:
                         prev_tstamp = tstamp
 
+                log.debug('ohlcv_page', symbol=self.p.dataname, granularity=granularity, since=since, limit=limit,
+                          received=received, added=added, first=data[0][0] if data else None, last=tstamp)
+                yield
 
-                # print("?", tstamp, till, dlen, len(self._data))
+                if tstamp is None or (till and tstamp >= till):
+                    break
 
-                if till and tstamp is not None:
-                    if tstamp >= till:
-                        break
-                    since = tstamp
+                if not added:
+                    break
+
+                # Continue right after the last bar received
+                window_end = since + requested * self._ts_delta if since is not None and self._ts_delta else None
+                since = tstamp + self._ts_delta if self._ts_delta else tstamp
 
-                if dlen == len(self._data):
+                if till and since > till:
                     break
+                if self._ts_delta and since + self._ts_delta > time.time() * 1000:
+                    break  # live edge: only the candle still open is left
+
+                if received < requested and window_end is not None:
+                    # Either bars are missing on the exchange or it truncated the
+                    # page to a smaller maximum: the next page tells
+                    short = (received, window_end)
+
+    def _validate(self, data, granularity):
+        '''Cleans a fetched or cached window and repairs its gaps according to ``gap_fill``'''
+        last_ts = self._last_ts or None
+        data, gaps = validate_ohlcv(data, self._ts_delta, last_ts, self.ohlcv_stats)
+
+        if gaps and self.p.gap_fill == 'refetch':
+            refetched = []
+            for start, missing in gaps:
+                # A single request sized to the gap: its page is short by design and
+                # must not be taken for a truncation (see CryptoStore.shrink_ohlcv_limit)
+                end = start + missing * self._ts_delta
+                page = self.store.fetch_ohlcv(self.p.dataname, timeframe=granularity, since=start,
+                                              limit=self.store.get_ohlcv_limit(self.p.dataname, missing),
+                                              params=self.p.fetch_ohlcv_params)
+                refetched.extend(ohlcv for ohlcv in page if start <= ohlcv[0] < end)
+            if refetched:
+                self.ohlcv_stats.refetched += len(refetched)
+                data, gaps = validate_ohlcv(data + refetched, self._ts_delta, last_ts)
+
+        if gaps and self.p.gap_fill == 'ffill':
+            data = fill_gaps(data, gaps, self._ts_delta, self._last_close, self.ohlcv_stats)
+
+        if gaps:
+            log.info('ohlcv_gaps', symbol=self.p.dataname, granularity=granularity, gaps=gaps)
+
+        return data
+
+    def _attach_derivatives(self, data, granularity, cached=False):
+        '''Appends the value of every ``derivatives`` series to the bars of ``data``'''
+        if not self.p.derivatives or not data:
+            return
+
+        timestamps = [ohlcv[0] for ohlcv in data]
+        for series in self.p.derivatives:
+            if cached:
+                # Cached on the bar grid next to the candles
+                points = self.store.query_cache('%s#%s' % (self.p.dataname, series), granularity,
+                                                datetime.utcfromtimestamp(timestamps[0] // 1000),
+                                                datetime.utcfromtimestamp(timestamps[-1] // 1000))
+            else:
+                points = self._fetch_derivative(series, granularity, timestamps)
+            for ohlcv, value in zip(data, align_asof(points, timestamps)):
+                ohlcv.append(value)
+
+    def _fetch_derivative(self, series, granularity, timestamps):
+        '''Fetches a derivatives series for bars, unless its last value still holds for all of them
+
+        Live polls then only request a series once its own period has rolled
+        over (e.g. every 8 hours for funding rates), not on every bar.
+        '''
+        held = self._derivative_held.get(series)
+        if held is not None and held[0][0] <= timestamps[0] and timestamps[-1] < held[1]:
+            return [held[0]]
+
+        points = self.store.fetch_derivative_history(series, self.p.dataname, granularity,
+                                                     timestamps[0], timestamps[-1] + 1)
+        period = self.store.get_derivative_period(series, granularity, points)
+        if points and period:
+            self._derivative_held[series] = (points[-1], points[-1][0] + period)
+        return points
+
+    def _granularity_ms(self, granularity):
+        if self._ts_delta is not None:
+            return self._ts_delta
+        return self.store.exchange.parse_timeframe(granularity) * 1000
 
     def _load_ticks(self):
         if self._last_id is None:
@@ -267,7 +623,15 @@ class CryptoFeed(with_metaclass(MetaCryptoFeed, DataBase)):
         except IndexError:
             return None  # no data in the queue
 
-        tstamp, open_, high, low, close, volume = ohlcv
+        if self._prefetcher is not None:
+            self._prefetcher.consumed()
+
+        tstamp, open_, high, low, close, volume = ohlcv[:6]
+
+        if self.store.tracer is not None:
+            self.store.tracer.bar_delivered(self.p.dataname, tstamp)
+        if self._recent is not None:
+            self._recent.append(ohlcv)
 
         dtime = datetime.utcfromtimestamp(tstamp // 1000)
 
@@ -277,6 +641,8 @@ class CryptoFeed(with_metaclass(MetaCryptoFeed, DataBase)):
         self.lines.low[0] = low
         self.lines.close[0] = close
         self.lines.volume[0] = volume
+        for line, value in zip(self._derivative_lines, ohlcv[6:]):
+            line[0] = value
 
         return True
 
@@ -284,4 +650,6 @@ class CryptoFeed(with_metaclass(MetaCryptoFeed, DataBase)):
         return self._state == self._ST_LIVE and self._data
 
     def islive(self):
+        if self.p.source is not None:
+            return self.p.source.islive()
         return not self.p.historical
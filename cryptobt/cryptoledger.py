@@ -0,0 +1,228 @@
+import collections
+import threading
+from datetime import datetime
+
+from backtrader.position import Position
+
+from .cryptolog import get_logger
+
+log = get_logger('ledger')
+
+
+class CryptoLedger(object):
+    '''Local account state maintained from order fills.
+
+    Balances are kept per asset as ``free``/``total`` amounts and positions
+    per symbol as backtrader ``Position`` objects, so the broker can answer
+    ``getcash``, ``getvalue`` and ``getposition`` without a REST call.
+
+    Spot fills move both the base and the quote asset. Fills on contract
+    markets (or on symbols the store has no market data for and which are
+    not written as ``BASE/QUOTE``) only move the position, as their balance
+    impact depends on the margin model of the exchange. Fees are always
+    deducted from the asset they are charged in.
+
+    The local state can drift from the exchange (funding, deposits, missed
+    fills ...). ``reconcile`` compares it with ``fetch_balance`` and, for
+    contract markets, ``fetch_positions`` and reports the differences through
+    the ``on_drift`` callback. ``start_reconcile`` runs it periodically in a
+    background thread.
+    '''
+
+    def __init__(self, store, balance=None, tolerance=1e-8, on_drift=None):
+        self.store = store
+        self.tolerance = tolerance
+        self.on_drift = on_drift
+
+        self.free = collections.defaultdict(float)
+        self.total = collections.defaultdict(float)
+        self.positions = collections.defaultdict(Position)
+
+        self.last_drift = None
+        self.last_reconcile = None
+
+        self._seq = 0  # bumped by every change of the local state, see reconcile
+
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        if balance:
+            self.set_balance(balance)
+
+    def set_balance(self, balance):
+        '''Replaces the local balances with a ccxt ``fetch_balance`` result'''
+        with self._lock:
+            self._seq += 1
+            self.free.clear()
+            self.total.clear()
+            for asset, amount in (balance.get('free') or {}).items():
+                self.free[asset] = amount or 0.0
+            for asset, amount in (balance.get('total') or {}).items():
+                self.total[asset] = amount or 0.0
+
+    def getcash(self, asset):
+        return self.free.get(asset, 0.0)
+
+    def getvalue(self, asset):
+        return self.total.get(asset, 0.0)
+
+    def getposition(self, symbol):
+        with self._lock:
+            return self.positions[symbol].clone()
+
+    def positions_state(self):
+        '''Returns the positions as ``{symbol: [size, price]}``'''
+        with self._lock:
+            return {symbol: [pos.size, pos.price] for symbol, pos in self.positions.items() if pos.size}
+
+    def restore_positions(self, state):
+        with self._lock:
+            self._seq += 1
+            for symbol, (size, price) in state.items():
+                self.positions[symbol].set(size, price)
+
+    def _split_symbol(self, symbol):
+        markets = getattr(self.store.exchange, 'markets', None) or {}
+        market = markets.get(symbol)
+        if market is not None:
+            return market['base'], market['quote'], bool(market.get('contract'))
+
+        if '/' in symbol:
+            base, quote = symbol.split(':')[0].split('/')
+            return base, quote, ':' in symbol
+
+        return None, self.store.currency, True
+
+    def _adjust(self, asset, amount):
+        self.free[asset] += amount
+        self.total[asset] += amount
+
+    def apply_fill(self, symbol, side, amount, price, fee=None):
+        '''Applies a single execution to positions and balances
+
+        - ``side``: 'buy' or 'sell'
+        - ``amount``: positive executed amount
+        - ``price``: execution price
+        - ``fee``: optional ccxt fee structure ``{'cost': ..., 'currency': ...}``
+        '''
+        base, quote, contract = self._split_symbol(symbol)
+        size = amount if side == 'buy' else -amount
+
+        with self._lock:
+            self._seq += 1
+            self.positions[symbol].update(size, price)
+
+            if not contract:
+                self._adjust(base, size)
+                self._adjust(quote, -size * price)
+
+            if fee and fee.get('cost'):
+                self._adjust(fee.get('currency') or quote, -fee['cost'])
+
+    def reconcile(self, balance=None, positions=None, resync=True):
+        '''Compares the ledger with the exchange state and returns the drift
+
+        If ``balance``/``positions`` are not given they are fetched from the
+        exchange (positions only where ``fetchPositions`` is supported).
+
+        Only the positions of contract markets are compared with the exchange
+        positions. A spot position is checked against the balance of its base
+        asset instead: it can neither be short nor exceed the holding.
+
+        The drift is returned as a dict with ``balances`` and ``positions``
+        entries mapping each asset/symbol to a ``(local, remote)`` tuple. If
+        ``resync`` is ``True`` the local state is replaced with the remote one
+        afterwards.
+
+        The exchange is queried without holding the ledger lock, so fills keep
+        being applied meanwhile. If the local state changed during the
+        requests the remote one can't be compared with it: nothing is done
+        and ``None`` is returned (the next reconcile will tell).
+        '''
+        drift = dict(balances={}, positions={})
+
+        seq = self._seq
+        if balance is None:
+            balance = self.store.get_wallet_balance(self.store.currency)
+
+        if positions is None and self.store.exchange.has.get('fetchPositions'):
+            positions = self.store.fetch_opened_positions()
+
+        with self._lock:
+            if self._seq != seq:
+                log.debug('ledger_reconcile_skipped', reason='fills applied during the requests')
+                return None
+
+            remote_total = balance.get('total') or {}
+            for asset in set(remote_total) | set(self.total):
+                local = self.total.get(asset, 0.0)
+                remote = remote_total.get(asset) or 0.0
+                if abs(local - remote) > self.tolerance:
+                    drift['balances'][asset] = (local, remote)
+
+            contracts = set()
+            for symbol, pos in list(self.positions.items()):
+                base, quote, contract = self._split_symbol(symbol)
+                if contract:
+                    contracts.add(symbol)
+                elif pos.size:
+                    holding = remote_total.get(base) or 0.0
+                    remote = min(max(pos.size, 0.0), holding)
+                    if abs(pos.size - remote) > self.tolerance:
+                        drift['positions'][symbol] = (pos.size, remote)
+
+            if positions is not None:
+                remote_sizes = {}
+                for position in positions:
+                    size = position.get('contracts') or 0.0
+                    if position.get('side') == 'short':
+                        size = -size
+                    remote_sizes[position['symbol']] = size
+
+                for symbol in set(remote_sizes) | contracts:
+                    local = self.positions[symbol].size
+                    remote = remote_sizes.get(symbol, 0.0)
+                    if abs(local - remote) > self.tolerance:
+                        drift['positions'][symbol] = (local, remote)
+
+            if resync:
+                self.set_balance(balance)
+                for symbol, (local, remote) in drift['positions'].items():
+                    pos = self.positions[symbol]
+                    pos.set(remote, pos.price if remote else 0.0)
+
+            self.last_drift = drift
+            self.last_reconcile = datetime.utcnow()
+
+        if drift['balances'] or drift['positions']:
+            if self.on_drift is not None:
+                self.on_drift(drift)
+            else:
+                log.warning('ledger_drift', drift=drift)
+
+        return drift
+
+    def start_reconcile(self, interval, resync=True):
+        '''Starts reconciling every ``interval`` seconds in a daemon thread'''
+        if self._thread is not None:
+            return
+
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    self.reconcile(resync=resync)
+                except Exception as e:
+                    # Exchange errors as well as the ones raised by on_drift: try again next time
+                    log.warning('ledger_reconcile_failed', error=e)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name='cryptobt-ledger', daemon=True)
+        self._thread.start()
+
+    def stop_reconcile(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
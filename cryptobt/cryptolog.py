@@ -0,0 +1,240 @@
+'''Structured logging of cryptobt.
+
+Every component logs events to a child of the ``cryptobt`` logger of the
+standard ``logging`` module (``cryptobt.feed``, ``cryptobt.broker``,
+``cryptobt.store`` ...). An event is a short name and keyword fields::
+
+    log = get_logger('broker')
+    log.debug('order_update', order_id=oid, order=ccxt_order)
+
+Disabled levels cost a cached level check: nothing is formatted and no
+record is created. The fields are kept as they are in the record and only
+rendered by the formatter of a handler which emits it, so a handler running
+in the background (see ``configure_logging``) also takes the formatting off
+the calling thread.
+
+The ``debug`` params of the feeds, broker and store enable the ``DEBUG``
+level of their logger (with a console handler if logging isn't configured).
+'''
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+ROOT = 'cryptobt'
+
+# No output unless the application configures logging (library convention)
+logging.getLogger(ROOT).addHandler(logging.NullHandler())
+
+
+class StructLogger(object):
+    '''Logs events with keyword fields to a ``logging.Logger``'''
+
+    __slots__ = ('logger',)
+
+    def __init__(self, logger):
+        self.logger = logger
+
+    def enabled(self, level=logging.DEBUG):
+        return self.logger.isEnabledFor(level)
+
+    def log(self, level, event, fields):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, event, extra={'fields': fields})
+
+    def debug(self, event, **fields):
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(event, extra={'fields': fields})
+
+    def info(self, event, **fields):
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info(event, extra={'fields': fields})
+
+    def warning(self, event, **fields):
+        if self.logger.isEnabledFor(logging.WARNING):
+            self.logger.warning(event, extra={'fields': fields})
+
+    def error(self, event, **fields):
+        if self.logger.isEnabledFor(logging.ERROR):
+            self.logger.error(event, extra={'fields': fields})
+
+
+def get_logger(name):
+    '''Returns the ``StructLogger`` of the ``cryptobt.<name>`` logger'''
+    return StructLogger(logging.getLogger('%s.%s' % (ROOT, name)))
+
+
+def _has_output(logger):
+    while logger is not None:
+        if any(not isinstance(handler, logging.NullHandler) for handler in logger.handlers):
+            return True
+        if not logger.propagate:
+            return False
+        logger = logger.parent
+    return False
+
+
+def set_debug(log):
+    '''Enables the ``DEBUG`` level of ``log`` (the ``debug`` params)
+
+    Events are printed to ``sys.stderr`` if logging isn't configured.
+    '''
+    log.logger.setLevel(logging.DEBUG)
+    if not _has_output(log.logger):
+        configure_logging(level=None, format='text', background=False)
+
+
+class JsonFormatter(logging.Formatter):
+    '''One JSON object per event: ``ts``, ``level``, ``logger``, ``event`` and the fields'''
+
+    def format(self, record):
+        data = dict(ts=record.created, level=record.levelname, logger=record.name, event=record.getMessage())
+        data.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    '''``time level logger event key=value ...`` lines'''
+
+    def format(self, record):
+        fields = getattr(record, 'fields', None) or {}
+        line = '{} {} {} {}'.format(datetime.fromtimestamp(record.created, timezone.utc).isoformat(), record.levelname,
+                                    record.name, record.getMessage())
+        if fields:
+            line += ' ' + ' '.join('{}={}'.format(key, json.dumps(value, default=str) if isinstance(value, (dict, list))
+                                                  else value) for key, value in fields.items())
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+
+class SampleFilter(logging.Filter):
+    '''Keeps one event out of ``every`` for each event name (all names if ``events`` is ``None``)'''
+
+    def __init__(self, every, events=None):
+        super(SampleFilter, self).__init__()
+        self.every = every
+        self.events = events
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        event = record.msg
+        if self.events is not None and event not in self.events:
+            return True
+        with self._lock:
+            count = self._counts.get(event, 0)
+            self._counts[event] = count + 1
+        return count % self.every == 0
+
+
+class RateLimitFilter(logging.Filter):
+    '''Lets at most ``rate`` events per second through for each event name (token bucket of ``burst``)
+
+    The next event let through carries the number of events dropped in a
+    ``suppressed`` field.
+    '''
+
+    def __init__(self, rate, burst=None, events=None):
+        super(RateLimitFilter, self).__init__()
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.events = events
+        self._buckets = {}  # event -> [tokens, last update, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        event = record.msg
+        if self.events is not None and event not in self.events:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(event)
+            if bucket is None:
+                bucket = self._buckets[event] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1.0:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1.0
+            suppressed, bucket[2] = bucket[2], 0
+        if suppressed:
+            record.fields = dict(getattr(record, 'fields', None) or {}, suppressed=suppressed)
+        return True
+
+
+class BackgroundHandler(logging.handlers.QueueHandler):
+    '''Hands the records over to ``handlers`` running in a background thread
+
+    The calling thread only enqueues the record: formatting and I/O happen
+    in the thread. When the queue (``maxsize`` records) is full the record
+    is dropped and counted in ``dropped`` instead of blocking the caller.
+    Filters added to this handler run on the calling thread, before the
+    record is enqueued.
+    '''
+
+    def __init__(self, handlers, maxsize=10000):
+        super(BackgroundHandler, self).__init__(queue.Queue(maxsize))
+        self.dropped = 0
+        self.listener = logging.handlers.QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+        self._started = True
+
+    def prepare(self, record):
+        # Formatted by the handlers of the listener, in its thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        if self._started:  # close is called again at exit
+            self._started = False
+            self.listener.stop()
+        super(BackgroundHandler, self).close()
+
+
+def configure_logging(level=logging.INFO, format='json', stream=None, path=None, background=True,
+                      sample=None, rate_limit=None, maxsize=10000):
+    '''Sets up a handler on the ``cryptobt`` logger and returns it
+
+    Params:
+      - ``level``: level of the ``cryptobt`` logger (unchanged if ``None``)
+      - ``format``: ``'json'`` (one object per line) or ``'text'``
+      - ``stream``/``path``: destination, ``sys.stderr`` by default
+      - ``background`` (default: ``True``): format and write the records in
+        a background thread (see ``BackgroundHandler``)
+      - ``sample``: keep one event out of ``sample`` per event name, or a
+        dict of ``{event: every}``
+      - ``rate_limit``: maximum events per second per event name
+      - ``maxsize``: capacity of the background queue
+    '''
+    logger = logging.getLogger(ROOT)
+    if level is not None:
+        logger.setLevel(level)
+
+    handler = logging.FileHandler(path) if path else logging.StreamHandler(stream)
+    handler.setFormatter(JsonFormatter() if format == 'json' else TextFormatter())
+    if background:
+        # Filtered before being enqueued: dropped events never take a slot of the queue
+        handler = BackgroundHandler([handler], maxsize=maxsize)
+
+    if isinstance(sample, dict):
+        for event, every in sample.items():
+            handler.addFilter(SampleFilter(every, events=(event,)))
+    elif sample:
+        handler.addFilter(SampleFilter(sample))
+    if rate_limit:
+        handler.addFilter(RateLimitFilter(rate_limit))
+
+    logger.addHandler(handler)
+    return handler
@@ -0,0 +1,147 @@
+import math
+from decimal import Decimal
+
+from backtrader import CommInfoBase
+from ccxt.base.decimal_to_precision import DECIMAL_PLACES, SIGNIFICANT_DIGITS, TICK_SIZE
+from ccxt.base.errors import InvalidOrder
+
+
+def _step(precision, mode):
+    '''Converts a ccxt precision to a rounding step (``None`` if not fixed)'''
+    if precision is None:
+        return None
+    if mode == TICK_SIZE:
+        return float(precision)
+    if mode == DECIMAL_PLACES:
+        return 10.0 ** -int(precision)
+    return None  # SIGNIFICANT_DIGITS: the step depends on the value
+
+
+def _digits(step):
+    '''Decimal places needed to print multiples of ``step`` without float noise'''
+    return max(0, -Decimal(repr(step)).normalize().as_tuple().exponent)
+
+
+def _significant(value, digits, rounding):
+    if not value:
+        return value
+    scale = 10.0 ** (int(digits) - 1 - int(math.floor(math.log10(abs(value)))))
+    return rounding(value * scale) / scale
+
+
+class MarketInfo(object):
+    '''Precomputed trading rules of a single market'''
+
+    __slots__ = ('symbol', 'amount_step', 'amount_digits', 'price_step', 'price_digits',
+                 'amount_sig', 'price_sig', 'min_amount', 'max_amount', 'min_price', 'max_price',
+                 'min_cost', 'max_cost', 'maker', 'taker', 'contract', 'contract_size')
+
+    def __init__(self, market, precision_mode):
+        self.symbol = market['symbol']
+        precision = market.get('precision') or {}
+        limits = market.get('limits') or {}
+
+        self.amount_step = _step(precision.get('amount'), precision_mode)
+        self.price_step = _step(precision.get('price'), precision_mode)
+        self.amount_digits = _digits(self.amount_step) if self.amount_step else None
+        self.price_digits = _digits(self.price_step) if self.price_step else None
+        significant = precision_mode == SIGNIFICANT_DIGITS
+        self.amount_sig = precision.get('amount') if significant else None
+        self.price_sig = precision.get('price') if significant else None
+
+        self.min_amount = (limits.get('amount') or {}).get('min')
+        self.max_amount = (limits.get('amount') or {}).get('max')
+        self.min_price = (limits.get('price') or {}).get('min')
+        self.max_price = (limits.get('price') or {}).get('max')
+        self.min_cost = (limits.get('cost') or {}).get('min')
+        self.max_cost = (limits.get('cost') or {}).get('max')
+
+        self.maker = market.get('maker')
+        self.taker = market.get('taker')
+        self.contract = bool(market.get('contract'))
+        self.contract_size = market.get('contractSize') or 1.0
+
+    def round_amount(self, amount):
+        '''Truncates ``amount`` to the lot size, like the exchange does'''
+        if self.amount_step:
+            # the epsilon keeps exact multiples from being truncated by float noise
+            return round(math.floor(amount / self.amount_step + 1e-9) * self.amount_step, self.amount_digits)
+        if self.amount_sig:
+            return _significant(amount, self.amount_sig, math.floor)
+        return amount
+
+    def round_price(self, price):
+        '''Rounds ``price`` to the nearest tick'''
+        if self.price_step:
+            return round(round(price / self.price_step) * self.price_step, self.price_digits)
+        if self.price_sig:
+            return _significant(price, self.price_sig, round)
+        return price
+
+    def check(self, amount, price=None, ref_price=None):
+        '''Returns ``(amount, price)`` normalised to the market precision
+
+        Raises ``InvalidOrder`` if they break the market limits. ``ref_price``
+        is used for the notional check of orders without a price (market
+        orders).
+        '''
+        amount = self.round_amount(amount)
+        if price is not None:
+            price = self.round_price(price)
+
+        if amount <= 0:
+            raise InvalidOrder('%s amount rounds to zero' % self.symbol)
+        if self.min_amount is not None and amount < self.min_amount:
+            raise InvalidOrder('%s amount %s below minimum %s' % (self.symbol, amount, self.min_amount))
+        if self.max_amount is not None and amount > self.max_amount:
+            raise InvalidOrder('%s amount %s above maximum %s' % (self.symbol, amount, self.max_amount))
+
+        if price is not None:
+            if self.min_price is not None and price < self.min_price:
+                raise InvalidOrder('%s price %s below minimum %s' % (self.symbol, price, self.min_price))
+            if self.max_price is not None and price > self.max_price:
+                raise InvalidOrder('%s price %s above maximum %s' % (self.symbol, price, self.max_price))
+
+        cost_price = price if price is not None else ref_price
+        if cost_price is not None:
+            cost = amount * cost_price * self.contract_size
+            if self.min_cost is not None and cost < self.min_cost:
+                raise InvalidOrder('%s notional %s below minimum %s' % (self.symbol, cost, self.min_cost))
+            if self.max_cost is not None and cost > self.max_cost:
+                raise InvalidOrder('%s notional %s above maximum %s' % (self.symbol, cost, self.max_cost))
+
+        return amount, price
+
+    def comminfo(self, maker=False):
+        '''Returns a backtrader commission scheme charging the market fee'''
+        fee = (self.maker if maker else self.taker) or 0.0
+        return CommInfoBase(commission=fee, commtype=CommInfoBase.COMM_PERC, percabs=True,
+                            stocklike=not self.contract, mult=self.contract_size)
+
+
+class MarketIndex(object):
+    '''Per-symbol index of the loaded ccxt markets.
+
+    Built once from ``exchange.markets`` so that order rules and fees are
+    looked up with a single dict access instead of going through ccxt on
+    every order.
+    '''
+
+    def __init__(self, markets, precision_mode=TICK_SIZE):
+        self._markets = {symbol: MarketInfo(market, precision_mode) for symbol, market in markets.items()}
+
+    def __contains__(self, symbol):
+        return symbol in self._markets
+
+    def __len__(self):
+        return len(self._markets)
+
+    def get(self, symbol):
+        return self._markets.get(symbol)
+
+    def check(self, symbol, amount, price=None, ref_price=None):
+        '''Normalises and validates an order. Unknown symbols are returned unchanged'''
+        info = self._markets.get(symbol)
+        if info is None:
+            return amount, price
+        return info.check(amount, price, ref_price)
@@ -0,0 +1,132 @@
+import bisect
+import collections
+import json
+import threading
+import time
+
+
+class MethodStats(object):
+    '''Counters of a single wrapped ``CryptoStore`` method'''
+
+    def __init__(self, buckets):
+        self.calls = 0  # attempts, including retried ones
+        self.successes = 0
+        self.retries = 0
+        self.errors = collections.Counter()  # by exception class name
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.latency_buckets = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.bytes_received = 0
+        self.rate_limit_wait = 0.0
+
+    def asdict(self, buckets):
+        return dict(calls=self.calls, successes=self.successes, retries=self.retries,
+                    errors=dict(self.errors),
+                    latency_sum=self.latency_sum, latency_max=self.latency_max,
+                    latency_avg=self.latency_sum / self.calls if self.calls else 0.0,
+                    latency_buckets=dict(zip([str(b) for b in buckets] + ['+Inf'], self.latency_buckets)),
+                    bytes_received=self.bytes_received, rate_limit_wait=self.rate_limit_wait)
+
+
+class StoreMetrics(object):
+    '''Per-endpoint call statistics of ``CryptoStore``.
+
+    Enable with ``CryptoStore(..., metrics=True)`` (or pass an instance to
+    customise the latency ``buckets``) and read them from ``store.metrics``.
+    Every attempt of a ``retry`` wrapped method is recorded with its latency,
+    the rate-limit sleep preceding it, the exception class if it failed and
+    the size of the HTTP response if it succeeded.
+
+    When disabled ``store.metrics`` is ``None`` and the wrapper only pays for
+    a single ``is None`` check per attempt.
+    '''
+
+    BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.started = time.time()
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, latency, rate_limit_wait, attempt, error=None, nbytes=0):
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = MethodStats(self.buckets)
+
+            stats.calls += 1
+            if attempt:
+                stats.retries += 1
+            if error is None:
+                stats.successes += 1
+                stats.bytes_received += nbytes
+            else:
+                stats.errors[type(error).__name__] += 1
+            stats.latency_sum += latency
+            stats.latency_max = max(stats.latency_max, latency)
+            stats.latency_buckets[bisect.bisect_left(self.buckets, latency)] += 1
+            stats.rate_limit_wait += rate_limit_wait
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self.started = time.time()
+
+    def snapshot(self):
+        '''Returns the statistics as a dict keyed by method name'''
+        with self._lock:
+            return {name: stats.asdict(self.buckets) for name, stats in self._stats.items()}
+
+    def to_prometheus(self, prefix='cryptobt_store'):
+        '''Renders the statistics in the Prometheus text exposition format'''
+        lines = []
+
+        def metric(name, kind, help_text):
+            lines.append('# HELP {}_{} {}'.format(prefix, name, help_text))
+            lines.append('# TYPE {}_{} {}'.format(prefix, name, kind))
+
+        with self._lock:
+            stats = sorted(self._stats.items())
+
+            metric('calls_total', 'counter', 'Attempted calls per method')
+            for name, s in stats:
+                lines.append('{}_calls_total{{method="{}"}} {}'.format(prefix, name, s.calls))
+
+            metric('retries_total', 'counter', 'Retried attempts per method')
+            for name, s in stats:
+                lines.append('{}_retries_total{{method="{}"}} {}'.format(prefix, name, s.retries))
+
+            metric('errors_total', 'counter', 'Failed attempts per method and error class')
+            for name, s in stats:
+                for error, count in sorted(s.errors.items()):
+                    lines.append('{}_errors_total{{method="{}",error="{}"}} {}'.format(
+                        prefix, name, error, count))
+
+            metric('received_bytes_total', 'counter', 'HTTP response bytes per method')
+            for name, s in stats:
+                lines.append('{}_received_bytes_total{{method="{}"}} {}'.format(
+                    prefix, name, s.bytes_received))
+
+            metric('rate_limit_wait_seconds_total', 'counter', 'Time slept for the rate limit per method')
+            for name, s in stats:
+                lines.append('{}_rate_limit_wait_seconds_total{{method="{}"}} {}'.format(
+                    prefix, name, s.rate_limit_wait))
+
+            metric('latency_seconds', 'histogram', 'Latency of each attempt per method')
+            for name, s in stats:
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), s.latency_buckets):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append('{}_latency_seconds_bucket{{method="{}",le="{}"}} {}'.format(
+                        prefix, name, le, cumulative))
+                lines.append('{}_latency_seconds_sum{{method="{}"}} {}'.format(prefix, name, s.latency_sum))
+                lines.append('{}_latency_seconds_count{{method="{}"}} {}'.format(prefix, name, s.calls))
+
+        return '\n'.join(lines) + '\n'
+
+    def write_jsonl(self, path):
+        '''Appends a timestamped snapshot as a single JSON line to ``path``'''
+        with open(path, 'a') as f:
+            f.write(json.dumps(dict(ts=time.time(), since=self.started, methods=self.snapshot())) + '\n')
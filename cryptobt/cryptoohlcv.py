@@ -0,0 +1,109 @@
+class OHLCVStats(object):
+    '''Counters of the OHLCV validation stage'''
+
+    __slots__ = ('rows', 'invalid', 'duplicates', 'out_of_order', 'gaps', 'missing', 'filled', 'refetched')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+    def asdict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return 'OHLCVStats(%s)' % ', '.join('%s=%d' % item for item in self.asdict().items())
+
+
+def validate_ohlcv(rows, ts_delta=None, last_ts=None, stats=None):
+    '''Cleans a batch of ccxt OHLCV rows in a single pass
+
+    Rows with missing values are dropped, duplicated timestamps keep the last
+    row received and the result is sorted by timestamp. If ``ts_delta`` is
+    known, missing bars are detected between consecutive rows and between
+    ``last_ts`` (the last bar already delivered) and the first row.
+
+    Returns ``(rows, gaps)`` where ``gaps`` is a list of
+    ``(first_missing_ts, missing_bars)`` tuples. ``stats`` (an
+    ``OHLCVStats``) is updated if given.
+    '''
+    by_ts = {}
+    invalid = out_of_order = 0
+    prev = None
+    for row in rows:
+        if len(row) != 6 or None in row:
+            invalid += 1
+            continue
+        ts = row[0]
+        if prev is not None and ts < prev:
+            out_of_order += 1
+        prev = ts
+        by_ts[ts] = row
+
+    valid = len(rows) - invalid
+    clean = [by_ts[ts] for ts in sorted(by_ts)]
+
+    gaps = []
+    if ts_delta and clean:
+        prev = last_ts if last_ts else clean[0][0]
+        for row in clean:
+            ts = row[0]
+            if ts - prev > ts_delta:
+                gaps.append((prev + ts_delta, (ts - prev) // ts_delta - 1))
+            prev = ts
+
+    if stats is not None:
+        stats.rows += valid
+        stats.invalid += invalid
+        stats.duplicates += valid - len(clean)
+        stats.out_of_order += out_of_order
+        stats.gaps += len(gaps)
+        stats.missing += sum(missing for _, missing in gaps)
+
+    return clean, gaps
+
+
+def fill_gaps(rows, gaps, ts_delta, prev_close=None, stats=None):
+    '''Forward fills ``gaps`` of the sorted ``rows`` with flat zero-volume bars
+
+    ``prev_close`` is the close of the bar before ``rows`` used for a gap
+    at the very start.
+    '''
+    if not gaps:
+        return rows
+
+    missing = dict(gaps)
+    filled = []
+    close = prev_close
+    prev_ts = None
+    for row in rows:
+        if prev_ts is None:
+            start = gaps[0][0] if gaps[0][0] < row[0] else None  # gap before the first row
+        else:
+            start = prev_ts + ts_delta
+        if start in missing and close is not None:
+            for i in range(missing[start]):
+                filled.append([start + i * ts_delta, close, close, close, close, 0.0])
+            if stats is not None:
+                stats.filled += missing[start]
+        filled.append(row)
+        close = row[4]
+        prev_ts = row[0]
+    return filled
+
+
+def align_asof(points, timestamps):
+    '''Aligns the sorted ``(timestamp, value)`` ``points`` to the sorted ``timestamps``
+
+    Every timestamp gets the value of the last point at or before it, ``nan``
+    before the first one (e.g. funding rates paid every 8 hours on 1 minute
+    bars).
+    '''
+    values = []
+    value = float('nan')
+    i, n = 0, len(points)
+    for ts in timestamps:
+        while i < n and points[i][0] <= ts:
+            value = points[i][1]
+            i += 1
+        values.append(value)
+    return values
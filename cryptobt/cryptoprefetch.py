@@ -0,0 +1,85 @@
+import threading
+
+
+class OHLCVPrefetcher(object):
+    '''Background fetching of the next OHLCV pages of a ``CryptoFeed``.
+
+    Runs the page fetches of the feed in a daemon thread while Cerebro
+    consumes the bars already queued. A new page (or cache block) is only
+    requested once fewer than ``low_water`` bars are left in the queue, so
+    the queue holds at most ``low_water`` bars plus one page.
+
+    ``pages`` is the generator of the historical window (``None`` if there is
+    none). Once it is exhausted ``backfilled`` is set and, for live feeds,
+    the thread keeps polling the exchange every ``poll_interval`` seconds
+    while the queue is low. An exception raised by a fetch is kept in
+    ``error`` and stops the thread.
+    '''
+
+    def __init__(self, feed, pages, live, low_water, poll_interval=1.0):
+        self.feed = feed
+        self.low_water = low_water
+        self.poll_interval = poll_interval
+
+        self.backfilled = pages is None
+        self.done = False
+        self.error = None
+
+        self._pages = pages
+        self._live = live
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='cryptobt-prefetch-%s' % feed.p.dataname,
+                                        daemon=True)
+        self._thread.start()
+
+    def _notify(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def _wait_low(self):
+        '''Blocks while the queue of the feed is above the low-water mark'''
+        with self._cond:
+            while not self._stop.is_set() and len(self.feed._data) >= self.low_water:
+                self._cond.wait(0.1)  # woken up by consumed(), the timeout covers a missed wake up
+        return not self._stop.is_set()
+
+    def _run(self):
+        try:
+            if self._pages is not None:
+                for _ in self._pages:
+                    self._notify()
+                    if not self._wait_low():
+                        return
+                self.backfilled = True
+                self._notify()
+
+            while self._live and self._wait_low():
+                last_ts = self.feed._last_ts
+                self.feed._fetch_ohlcv()
+                self._notify()
+                if self.feed._last_ts == last_ts:
+                    self._stop.wait(self.poll_interval)  # nothing new yet
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+
+    def consumed(self):
+        '''Called by the feed after taking a bar: wakes the thread up at the low-water mark'''
+        if len(self.feed._data) == self.low_water - 1:
+            self._notify()
+
+    def wait(self, timeout=None):
+        '''Blocks until bars are queued, the historical window is over or the thread stopped'''
+        with self._cond:
+            self._cond.notify_all()
+            self._cond.wait_for(lambda: len(self.feed._data) or self.backfilled or self.done, timeout)
+        if self.error is not None:
+            raise self.error
+
+    def stop(self):
+        self._stop.set()
+        self._notify()
+        self._thread.join()
@@ -0,0 +1,330 @@
+import math
+import random
+import threading
+import time
+from datetime import datetime
+
+from ccxt.base.errors import (InsufficientFunds, InvalidOrder, OrderNotFound, RateLimitExceeded,
+                              RequestTimeout)
+from ccxt.base.exchange import Exchange
+
+
+class SimulatedExchange(object):
+    '''Local ccxt compatible exchange for load tests and benchmarks.
+
+    Implements the subset of the unified ccxt API used by cryptobt on top of
+    a deterministic synthetic price series, so results are reproducible and
+    no network access is needed. Select it with
+    ``CryptoStore(..., transport_params={"mode": "simulate", ...})``; the
+    remaining keys are passed to the constructor.
+
+    Params:
+      - ``symbols`` (default: ``('BTC/USDT',)``): markets to list
+      - ``balance`` (default: ``{'USDT': 100000.0}``): initial free balances
+      - ``latency`` (default: ``0.0``): seconds added to every request
+      - ``jitter`` (default: ``0.0``): uniform random extra latency in seconds
+      - ``rate_limit`` (default: ``0``): ``rateLimit`` in milliseconds. Calls
+        closer to each other raise ``RateLimitExceeded`` if
+        ``enforce_rate_limit`` is set
+      - ``error_rate`` (default: ``0.0``): probability of a request failing
+        with ``RequestTimeout``
+      - ``ohlcv_max_limit`` (default: ``1000``): maximum candles per request
+      - ``fill_mode`` (default: ``'immediate'``): ``'immediate'`` fills every
+        order on creation, ``'cross'`` fills market orders on creation and
+        limit orders once the synthetic price crosses them, ``'never'``
+        leaves every order open
+      - ``fee`` (default: ``0.001``): taker fee rate charged in the quote asset
+      - ``seed`` (default: ``0``): seed of the error injection and jitter
+    '''
+
+    id = 'simulated'
+    name = 'Simulated'
+
+    timeframes = {'1m': '1m', '3m': '3m', '5m': '5m', '15m': '15m', '30m': '30m',
+                  '1h': '1h', '2h': '2h', '4h': '4h', '6h': '6h', '12h': '12h',
+                  '1d': '1d', '1w': '1w'}
+
+    parse_timeframe = staticmethod(Exchange.parse_timeframe)
+
+    def __init__(self, symbols=('BTC/USDT',), balance=None, latency=0.0, jitter=0.0,
+                 rate_limit=0, enforce_rate_limit=False, error_rate=0.0, ohlcv_max_limit=1000,
+                 fill_mode='immediate', fee=0.001, seed=0):
+        self.rateLimit = rate_limit
+        self.enforce_rate_limit = enforce_rate_limit
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.ohlcv_max_limit = ohlcv_max_limit
+        self.fill_mode = fill_mode
+        self.fee = fee
+        self.last_http_response = None
+
+        self.has = {'fetchOHLCV': True, 'fetchTrades': True, 'fetchOrderBook': True,
+                    'fetchFundingRateHistory': True, 'fetchOpenInterestHistory': True, 'fetchOrder': True,
+                    'fetchOpenOrders': True, 'fetchPositions': False, 'cancelOrder': True,
+                    'cancelOrders': True, 'cancelAllOrders': True,
+                    'editOrder': False, 'createOrder': True, 'fetchBalance': True}
+
+        self.features = {'spot': {'fetchOHLCV': {'limit': ohlcv_max_limit}}}
+
+        self.markets = {}
+        for symbol in symbols:
+            base, quote = symbol.split('/')
+            self.markets[symbol] = dict(
+                id=symbol.replace('/', ''), symbol=symbol, base=base, quote=quote,
+                type='spot', spot=True, contract=False, active=True,
+                taker=fee, maker=fee,
+                precision=dict(amount=1e-6, price=0.01),
+                limits=dict(amount=dict(min=1e-5, max=None), price=dict(min=0.01, max=None),
+                            cost=dict(min=5.0, max=None)))
+
+        self.balance = dict(balance or {'USDT': 100000.0})
+        self.orders = {}
+        self.requests = 0
+        self.order_listeners = []
+
+        self._random = random.Random(seed)
+        self._next_id = 1
+        self._last_request = 0.0
+        self._lock = threading.Lock()
+
+    def set_sandbox_mode(self, enabled):
+        pass
+
+    def _request(self):
+        '''Applies rate limit, latency and error injection to a request'''
+        with self._lock:
+            self.requests += 1
+            now = time.time()
+            too_fast = self.enforce_rate_limit and (now - self._last_request) * 1000 < self.rateLimit
+            self._last_request = now
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+            failed = self.error_rate and self._random.random() < self.error_rate
+
+        if delay:
+            time.sleep(delay)
+        if too_fast:
+            raise RateLimitExceeded('%s rate limit exceeded' % self.id)
+        if failed:
+            raise RequestTimeout('%s simulated request timeout' % self.id)
+
+    @staticmethod
+    def _price(index):
+        '''Deterministic synthetic price for the bar ``index`` since the epoch'''
+        noise = ((index * 2654435761) % 1000) / 1000.0 - 0.5
+        return 30000.0 + 2000.0 * math.sin(index / 500.0) + 300.0 * math.sin(index / 37.0) + 20.0 * noise
+
+    def _bar(self, index, duration):
+        open_ = self._price(index)
+        close = self._price(index + 1)
+        spread = abs(close - open_) + 5.0
+        volume = 10.0 + (index * 7919) % 100
+        return [index * duration, open_, max(open_, close) + spread, min(open_, close) - spread, close, volume]
+
+    def ticker_price(self, symbol=None):
+        '''Current synthetic price (1m resolution)'''
+        return self._price(int(time.time() // 60))
+
+    def load_markets(self, reload=False, params={}):
+        self._request()
+        return self.markets
+
+    def market(self, symbol):
+        return self.markets[symbol]
+
+    def fetch_ohlcv(self, symbol, timeframe='1m', since=None, limit=None, params={}):
+        self._request()
+        duration = self.parse_timeframe(timeframe) * 1000
+        limit = min(limit or self.ohlcv_max_limit, self.ohlcv_max_limit)
+        now = int(time.time() * 1000)
+        last = now // duration  # the current, still open, bar
+        first = last - limit + 1 if since is None else -(-since // duration)
+        return [self._bar(i, duration) for i in range(first, min(first + limit, last + 1))]
+
+    def fetch_trades(self, symbol, since=None, limit=None, params={}):
+        self._request()
+        now = time.time()
+        trades = []
+        for i in range(limit or 50, 0, -1):
+            ts = now - i
+            trades.append(dict(id='%d' % int(ts * 1000), symbol=symbol, timestamp=int(ts * 1000),
+                               datetime=datetime.utcfromtimestamp(ts).strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+                               side='buy', price=self._price(int(ts // 60)), amount=0.01))
+        return trades
+
+    def fetch_order_book(self, symbol, limit=None, params={}):
+        self._request()
+        now = time.time()
+        price = self.ticker_price(symbol)
+        tick = self.markets[symbol]['precision']['price']
+        index = int(now)
+        bids, asks = [], []
+        for i in range(limit or 100):
+            size = 0.1 + ((index + i) * 7919) % 50 / 10.0
+            bids.append([round(price - (i + 1) * tick * 5, 2), size])
+            asks.append([round(price + (i + 1) * tick * 5, 2), 0.1 + ((index - i) * 104729) % 50 / 10.0])
+        return dict(symbol=symbol, bids=bids, asks=asks, timestamp=int(now * 1000),
+                    datetime=None, nonce=None)
+
+    def _history(self, since, limit, duration):
+        '''Timestamps of a paged history endpoint, up to now'''
+        now = int(time.time() * 1000)
+        last = now // duration
+        limit = min(limit or self.ohlcv_max_limit, self.ohlcv_max_limit)
+        first = last - limit + 1 if since is None else -(-since // duration)
+        return [i * duration for i in range(first, min(first + limit, last + 1))]
+
+    def fetch_funding_rate_history(self, symbol=None, since=None, limit=None, params={}):
+        self._request()
+        duration = 8 * 60 * 60 * 1000
+        return [dict(symbol=symbol, timestamp=ts, fundingRate=0.0001 * math.sin(ts / duration / 3.0))
+                for ts in self._history(since, limit, duration)]
+
+    def fetch_open_interest_history(self, symbol, timeframe='1h', since=None, limit=None, params={}):
+        self._request()
+        duration = self.parse_timeframe(timeframe) * 1000
+        return [dict(symbol=symbol, timestamp=ts, openInterestAmount=1000.0 + (ts // duration * 7919) % 500,
+                     openInterestValue=None) for ts in self._history(since, limit, duration)]
+
+    def fetch_balance(self, params={}):
+        self._request()
+        with self._lock:
+            used = {}
+            for order in self.orders.values():
+                if order['status'] == 'open' and order['side'] == 'buy':
+                    quote = self.markets[order['symbol']]['quote']
+                    used[quote] = used.get(quote, 0.0) + order['remaining'] * order['price']
+            free = {asset: amount - used.get(asset, 0.0) for asset, amount in self.balance.items()}
+            return dict(free=free, used=used, total=dict(self.balance))
+
+    def _fill(self, order, price):
+        market = self.markets[order['symbol']]
+        amount = order['remaining']
+        cost = amount * price
+        fee = cost * self.fee
+        sign = 1 if order['side'] == 'buy' else -1
+        self.balance[market['base']] = self.balance.get(market['base'], 0.0) + sign * amount
+        self.balance[market['quote']] = self.balance.get(market['quote'], 0.0) - sign * cost - fee
+
+        now = int(time.time() * 1000)
+        order['trades'].append(dict(id='%s-%d' % (order['id'], len(order['trades']) + 1), order=order['id'],
+                                    symbol=order['symbol'], side=order['side'], amount=amount, price=price,
+                                    cost=cost, timestamp=now, datetime=order['datetime'],
+                                    fee=dict(cost=fee, currency=market['quote'])))
+        order['filled'] += amount
+        order['remaining'] = 0.0
+        order['cost'] += cost
+        order['average'] = order['cost'] / order['filled']
+        order['fee'] = dict(cost=order['fee']['cost'] + fee, currency=market['quote'])
+        order['status'] = 'closed'
+        order['lastTradeTimestamp'] = now
+        self._publish(order)
+
+    def _match(self, order):
+        if order['status'] != 'open' or self.fill_mode == 'never':
+            return
+        price = self.ticker_price(order['symbol'])
+        if order['type'] == 'market' or self.fill_mode == 'immediate':
+            self._fill(order, price if order['type'] == 'market' else order['price'])
+        elif (order['side'] == 'buy' and price <= order['price']) or \
+                (order['side'] == 'sell' and price >= order['price']):
+            self._fill(order, order['price'])
+
+    def subscribe_orders(self, callback):
+        '''Calls ``callback`` with a copy of every order created, filled or canceled (see ``SimulatedOrderStream``)'''
+        self.order_listeners.append(callback)
+
+    def unsubscribe_orders(self, callback):
+        self.order_listeners.remove(callback)
+
+    def _publish(self, order):
+        for callback in list(self.order_listeners):
+            callback(dict(order, trades=list(order['trades'])))
+
+    def match_orders(self):
+        '''Matches every open order against the current price, as the exchange would on its own'''
+        with self._lock:
+            for order in list(self.orders.values()):
+                self._match(order)
+
+    def create_order(self, symbol, type, side, amount, price=None, params={}):
+        self._request()
+        if symbol not in self.markets:
+            raise InvalidOrder('%s unknown symbol %s' % (self.id, symbol))
+        if amount <= 0:
+            raise InvalidOrder('%s invalid amount %s' % (self.id, amount))
+        if type != 'market' and not price:
+            raise InvalidOrder('%s price required for %s orders' % (self.id, type))
+
+        market = self.markets[symbol]
+        if side == 'buy' and (price or self.ticker_price(symbol)) * amount > self.balance.get(market['quote'], 0.0):
+            raise InsufficientFunds('%s insufficient %s balance' % (self.id, market['quote']))
+
+        with self._lock:
+            oid = '%d' % self._next_id
+            self._next_id += 1
+            now = int(time.time() * 1000)
+            order = dict(id=oid, clientOrderId=None, symbol=symbol, type=type, side=side,
+                         amount=amount, price=price, status='open', filled=0.0, remaining=amount,
+                         cost=0.0, average=None, trades=[], fee=dict(cost=0.0, currency=market['quote']),
+                         timestamp=now, datetime=datetime.utcfromtimestamp(now / 1000.0).isoformat() + 'Z',
+                         lastTradeTimestamp=None, info={})
+            self.orders[oid] = order
+            self._publish(order)
+            self._match(order)
+            return dict(order, trades=list(order['trades']))
+
+    def fetch_order(self, id, symbol=None, params={}):
+        self._request()
+        with self._lock:
+            order = self.orders.get(id)
+            if order is None:
+                raise OrderNotFound('%s order %s not found' % (self.id, id))
+            self._match(order)
+            return dict(order, trades=list(order['trades']))
+
+    def fetch_open_orders(self, symbol=None, since=None, limit=None, params={}):
+        self._request()
+        with self._lock:
+            return [dict(o, trades=list(o['trades'])) for o in self.orders.values()
+                    if o['status'] == 'open' and (symbol is None or o['symbol'] == symbol)]
+
+    # ccxt exposes the camelCase aliases as well
+    fetchOpenOrders = fetch_open_orders
+
+    def cancel_order(self, id, symbol=None, params={}):
+        self._request()
+        with self._lock:
+            order = self.orders.get(id)
+            if order is None:
+                raise OrderNotFound('%s order %s not found' % (self.id, id))
+            if order['status'] != 'open':
+                raise OrderNotFound('%s order %s is %s' % (self.id, id, order['status']))
+            order['status'] = 'canceled'
+            self._publish(order)
+            return dict(order, trades=list(order['trades']))
+
+    def _cancel_open(self, ids):
+        canceled = []
+        with self._lock:
+            for oid in ids:
+                order = self.orders.get(oid)
+                if order is not None and order['status'] == 'open':
+                    order['status'] = 'canceled'
+                    self._publish(order)
+                    canceled.append(dict(order, trades=list(order['trades'])))
+        return canceled
+
+    def cancel_orders(self, ids, symbol=None, params={}):
+        '''Batch cancel: the orders no longer open are left out of the reply'''
+        self._request()
+        return self._cancel_open(ids)
+
+    def cancel_all_orders(self, symbol=None, params={}):
+        self._request()
+        return self._cancel_open([oid for oid, o in list(self.orders.items())
+                                  if symbol is None or o['symbol'] == symbol])
+
+    def fetch_positions(self, symbols=None, params={}):
+        self._request()
+        return []
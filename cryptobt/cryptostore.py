@@ -1,15 +1,21 @@
+import importlib
 import os.path
 import time
 from datetime import datetime
 from functools import wraps
-from tscache import TimeSeriesCache
 
 import backtrader as bt
-import ccxt
 import tempfile
 from backtrader.metabase import MetaParams
 from backtrader.utils.py3 import with_metaclass
-from ccxt.base.errors import NetworkError, ExchangeError
+
+from .cryptocheckpoint import Checkpoint
+from .cryptolog import get_logger, set_debug
+from .cryptometrics import StoreMetrics
+from .cryptoohlcv import align_asof, validate_ohlcv
+from .cryptotrace import LatencyTracer
+
+log = get_logger('store')
 
 
 class MetaSingleton(MetaParams):
@@ -35,6 +41,26 @@ class CryptoStore(with_metaclass(MetaSingleton, object)):
 
     Added new private_end_point method to allow using any private non-unified end point
 
+    The ``order_interceptor`` is called synchronously. Wrap it in an ``OrderDispatcher``
+    to deliver intercepted orders from a background worker instead.
+
+    Pass ``metrics=True`` to record per-method call counts, latencies, retries,
+    errors, response sizes and rate-limit waits in ``store.metrics`` (see
+    ``StoreMetrics``).
+
+    Pass ``tracer=True`` to trace live bars from the candle close on the exchange
+    to the order acknowledgement in ``store.tracer`` (see ``LatencyTracer``).
+
+    ``transport_params`` records or replays the exchange traffic, e.g.
+    ``{"mode": "record", "path": "session.jsonl.gz"}`` to record a live session and
+    ``{"mode": "replay", "path": "session.jsonl.gz", "realtime": False}`` to serve it
+    again offline (see ``RecordingExchange`` and ``ReplayExchange``).
+    ``{"mode": "simulate", ...}`` trades against a local ``SimulatedExchange``.
+
+    ``checkpoint_params`` (e.g. ``{"path": "bot.ckpt", "interval": 60, "bars": 500}``)
+    periodically saves the live feed and broker state and resumes from it on
+    restart (see ``Checkpoint``).
+
     '''
 
     # Supported granularities
@@ -62,29 +88,77 @@ class CryptoStore(with_metaclass(MetaSingleton, object)):
         (bt.TimeFrame.Years, 1): '1y',
     }
 
+    # Candles per request used when the exchange doesn't publish its maximum
+    _DEFAULT_OHLCV_LIMIT = 100
+
+    # Extra series a CryptoFeed can align to its bars (see ``fetch_derivative_history``)
+    DERIVATIVE_SERIES = ('funding_rate', 'mark_price', 'index_price', 'open_interest')
+    _FUNDING_LOOKBACK = 24 * 60 * 60 * 1000  # funding is paid every 1 to 8 hours
+    # Periods of the open interest history the exchanges have in common (from the finest)
+    OPEN_INTEREST_PERIODS = ('5m', '15m', '30m', '1h', '4h', '1d')
+
     BrokerCls = None  # broker class will auto register
     DataCls = None  # data class will auto register
 
     @classmethod
     def getdata(cls, *args, **kwargs):
         '''Returns ``DataCls`` with args, kwargs'''
+        if cls.DataCls is None:
+            importlib.import_module('.cryptofeed', __package__)  # registers DataCls
         return cls.DataCls(*args, **kwargs)
 
     @classmethod
     def getbroker(cls, *args, **kwargs):
         '''Returns broker with *args, **kwargs from registered ``BrokerCls``'''
+        if cls.BrokerCls is None:
+            importlib.import_module('.cryptobroker', __package__)  # registers BrokerCls
         return cls.BrokerCls(*args, **kwargs)
 
     def __init__(self, exchange, currency, config, retries, debug=False, sandbox=False,
                  order_interceptor=None,
-                 cache_params={ "basedir": None, "limit": 1500, "block_size": 6000 }):
-        self.exchange = getattr(ccxt, exchange)(config)
-        if sandbox:
-            self.exchange.set_sandbox_mode(True)
+                 cache_params={ "basedir": None, "limit": 1500, "block_size": 6000 },
+                 metrics=False, tracer=None, transport_params=None, checkpoint_params=None):
+        # ccxt imports every exchange class it ships: loaded here instead of
+        # at import time so that processes not creating a store skip it
+        from ccxt.base.errors import NetworkError, ExchangeError, InvalidOrder, InsufficientFunds
+        self._retry_errors = (NetworkError, ExchangeError)
+        # exchange errors a retry would only repeat: rejected orders and cancels
+        # of orders already closed (OrderNotFound is an InvalidOrder)
+        self._final_errors = (InvalidOrder, InsufficientFunds)
+
+        transport_params = transport_params or {}
+        mode = transport_params.get("mode")
+        if mode == "replay":
+            from .cryptotransport import ReplayExchange
+            self.exchange = ReplayExchange(transport_params["path"], transport_params.get("realtime", False))
+        elif mode == "simulate":
+            from .cryptosim import SimulatedExchange
+            self.exchange = SimulatedExchange(**{k: v for k, v in transport_params.items() if k != "mode"})
+        else:
+            import ccxt
+            self.exchange = getattr(ccxt, exchange)(config)
+            if sandbox:
+                self.exchange.set_sandbox_mode(True)
+            if mode == "record":
+                from .cryptotransport import RecordingExchange
+                self.exchange = RecordingExchange(self.exchange, transport_params["path"])
+            elif mode is not None:
+                raise ValueError("Unknown transport mode '%s'" % mode)
         self.currency = currency
         self.retries = retries
         self.debug = debug
+        if debug:
+            set_debug(log)
+        if isinstance(metrics, StoreMetrics):
+            self.metrics = metrics
+        else:
+            self.metrics = StoreMetrics() if metrics else None
+        if isinstance(tracer, LatencyTracer):
+            self.tracer = tracer
+        else:
+            self.tracer = LatencyTracer() if tracer else None
         balance = self.exchange.fetch_balance() if 'secret' in config else 0
+        self._balance = balance if balance else {}
         try:
             if balance == 0 or not balance['free'][currency]:
                 self._cash = 0
@@ -107,14 +181,28 @@ class CryptoStore(with_metaclass(MetaSingleton, object)):
 
             def fetcher(symbol: str, granularity: str, start: datetime, limit: int):
                 since = int((start - datetime(1970, 1, 1)).total_seconds() * 1000)
-                return self.fetch_ohlcv(symbol, timeframe=granularity, since=since, limit=limit)
+                symbol, _, series = symbol.partition('#')
+                if series:
+                    return self.fetch_derivative_grid(series, symbol, granularity, since, limit)
+                return self.fetch_ohlcv_pages(symbol, timeframe=granularity, since=since, count=limit)
 
+            from tscache import TimeSeriesCache
             self.cache = TimeSeriesCache(cache_path, fetcher, fetch_limit, block_size)
         else:
             self.cache = None
 
         self.order_interceptor = order_interceptor
 
+        if isinstance(checkpoint_params, dict):
+            self.checkpoint = Checkpoint(checkpoint_params["path"], checkpoint_params.get("interval") or 60,
+                                         checkpoint_params.get("bars") or 500)
+        else:
+            self.checkpoint = None
+
+        self._market_index = None
+        self._ohlcv_limits = {}  # symbol -> maximum candles per request
+        self._timeframe_ms = {}  # granularity -> duration in milliseconds
+
     def get_granularity(self, timeframe, compression):
         if not self.exchange.has['fetchOHLCV']:
             raise NotImplementedError("'%s' exchange doesn't support fetching OHLCV data" % \
@@ -132,21 +220,256 @@ class CryptoStore(with_metaclass(MetaSingleton, object)):
 
         return granularity
 
+    def get_timeframe_ms(self, granularity):
+        '''Returns the duration of ``granularity`` in milliseconds
+
+        ``None`` is returned for calendar based granularities (months, years)
+        whose duration varies.
+        '''
+        if granularity[-1] in ('M', 'y'):
+            return None
+        duration = self._timeframe_ms.get(granularity)
+        if duration is None:
+            duration = self._timeframe_ms[granularity] = int(self.exchange.parse_timeframe(granularity) * 1000)
+        return duration
+
+    def _ohlcv_feature_limits(self, symbol):
+        '''Collects the fetchOHLCV limits published in ccxt ``features`` for ``symbol``'''
+        features = getattr(self.exchange, 'features', None) or {}
+        market = (getattr(self.exchange, 'markets', None) or {}).get(symbol)
+        if market is not None:
+            section = features.get(market.get('type')) or {}
+            if 'fetchOHLCV' not in section:
+                section = section.get('inverse' if market.get('inverse') else 'linear') or {}
+            sections = [section]
+        else:
+            sections = []
+            for section in features.values():
+                if isinstance(section, dict):
+                    sections.extend([section] if 'fetchOHLCV' in section else
+                                     [s for s in section.values() if isinstance(s, dict)])
+
+        limits = []
+        for section in sections:
+            limit = (section.get('fetchOHLCV') or {}).get('limit')
+            if limit:
+                limits.append(limit)
+        return limits
+
+    def get_ohlcv_limit(self, symbol, requested=None):
+        '''Returns the page size to use when fetching candles of ``symbol``
+
+        The maximum is taken from the exchange ccxt metadata the first time and
+        lowered by ``shrink_ohlcv_limit`` when the exchange truncates a page. A
+        ``requested`` limit is honoured as long as it doesn't exceed it.
+        '''
+        limit = self._ohlcv_limits.get(symbol)
+        if limit is None:
+            # the smallest one is safe if the market type is unknown
+            limit = min(self._ohlcv_feature_limits(symbol) or [self._DEFAULT_OHLCV_LIMIT])
+            self._ohlcv_limits[symbol] = limit
+        return min(requested, limit) if requested else limit
+
+    def shrink_ohlcv_limit(self, symbol, received):
+        '''Records that the exchange returned only ``received`` candles for a full page
+
+        Only call it once the page is known to be truncated (see
+        ``ohlcv_truncated``): a page is also short at the live edge or when the
+        exchange has no candles for part of the window.
+        '''
+        if received > 0 and received < self.get_ohlcv_limit(symbol):
+            log.info('ohlcv_limit_lowered', symbol=symbol, limit=received)
+            self._ohlcv_limits[symbol] = received
+        return self.get_ohlcv_limit(symbol)
+
+    @staticmethod
+    def ohlcv_truncated(short, page):
+        '''Tells whether a short page was truncated by the exchange
+
+        ``short`` is ``(received, window_end)`` of the short page, ``page`` the
+        page requested right after its last candle. The short page was
+        truncated if ``page`` has candles which were inside its window.
+        '''
+        return bool(page) and page[0][0] < short[1]
+
+    def fetch_ohlcv_pages(self, symbol, timeframe, since, count, params={}):
+        '''Fetches ``count`` candles from ``since`` using the largest safe pages'''
+        duration = self.get_timeframe_ms(timeframe)
+        now = int(time.time() * 1000)
+        end = since + count * duration if duration else None
+
+        data = []
+        short = None  # last short page, until the next one tells whether it was truncated
+        while len(data) < count:
+            limit = self.get_ohlcv_limit(symbol, count - len(data))
+            page = self.fetch_ohlcv(symbol, timeframe=timeframe, since=since, limit=limit, params=params)
+            page = [ohlcv for ohlcv in page if ohlcv[0] >= since and (end is None or ohlcv[0] < end)]
+            if short is not None and self.ohlcv_truncated(short, page):
+                self.shrink_ohlcv_limit(symbol, short[0])
+            if not page:
+                break
+            data.extend(page)
+            if duration is None:
+                break
+            window_end = since + limit * duration
+            since = page[-1][0] + duration
+            if since >= end or since + duration > now:
+                break  # done, or only the candle still open is left
+            short = (len(page), window_end) if len(page) < limit else None
+
+        return validate_ohlcv(data)[0]
+
+    def iter_cache_blocks(self, symbol, granularity, start, end):
+        '''Yields ``(rows, last)`` for every cache block from ``start`` to ``end`` (inclusive)
+
+        Missing blocks are fetched through the cache fetcher first. Rows are
+        selected by timestamp: ``TimeSeriesCache.query`` slices the blocks by
+        position, which fails for ranges spanning several blocks or ending on
+        the last bar of a block.
+        '''
+        from tscache import tscache
+        cache = self.cache
+        since = int((start - datetime(1970, 1, 1)).total_seconds() * 1000)
+        until = int((end - datetime(1970, 1, 1)).total_seconds() * 1000)
+        first = tscache._calculate_index(start, granularity) // cache.block_size
+        last = tscache._calculate_index(end, granularity) // cache.block_size
+
+        for block_index in range(first, last + 1):
+            path = tscache._get_block_path(cache.basedir, symbol, granularity, block_index)
+            if not os.path.isfile(path):
+                tscache._fetch_block(cache.basedir, symbol, granularity, block_index, cache.limit,
+                                     cache.block_size, cache.fetcher, 0, 0)
+            block = tscache._load_block_by_path(path)
+            yield [row for row in block if since <= row[0] <= until], block_index == last
+
+    def query_cache(self, symbol, granularity, start, end):
+        '''Returns the cached candles of ``symbol`` from ``start`` to ``end`` (inclusive)'''
+        return [row for rows, _ in self.iter_cache_blocks(symbol, granularity, start, end) for row in rows]
+
+    def fetch_derivative_history(self, series, symbol, timeframe, since, until):
+        '''Returns the sorted ``(timestamp, value)`` points of a derivatives series
+
+        ``series`` is one of ``DERIVATIVE_SERIES``. Funding rates are fetched
+        from ``_FUNDING_LOOKBACK`` before ``since`` and open interest (at the
+        period of ``get_open_interest_period``) from one period before, so
+        that the value in force at ``since`` is known.
+        '''
+        duration = self.get_timeframe_ms(timeframe)
+        if series in ('mark_price', 'index_price'):
+            # ccxt fetchMarkOHLCV/fetchIndexOHLCV are fetch_ohlcv with a price param
+            count = (until - since) // duration + 1 if duration else self.get_ohlcv_limit(symbol)
+            rows = self.fetch_ohlcv_pages(symbol, timeframe, since, count, params={'price': series.split('_')[0]})
+            return [(row[0], row[4]) for row in rows]
+        if series == 'funding_rate':
+            return self._fetch_history(lambda since: self.fetch_funding_rate_history(symbol, since=since),
+                                       ('fundingRate',), since - self._FUNDING_LOOKBACK, until)
+        if series == 'open_interest':
+            period = self.get_open_interest_period(timeframe)
+            return self._fetch_history(lambda since: self.fetch_open_interest_history(symbol, period, since=since),
+                                       ('openInterestAmount', 'openInterestValue'),
+                                       since - self.get_timeframe_ms(period), until)
+        raise ValueError("Unknown derivatives series '%s'" % series)
+
+    def get_open_interest_period(self, timeframe):
+        '''Returns the open interest period to request for bars of ``timeframe``
+
+        The longest of ``OPEN_INTEREST_PERIODS`` not longer than a bar, or the
+        finest one for shorter bars: the values are held until the next one.
+        '''
+        duration = self.get_timeframe_ms(timeframe)
+        period = self.OPEN_INTEREST_PERIODS[0]
+        for candidate in self.OPEN_INTEREST_PERIODS:
+            if duration is None or self.get_timeframe_ms(candidate) <= duration:
+                period = candidate
+        return period
+
+    def get_derivative_period(self, series, timeframe, points):
+        '''Returns how often a derivatives series gets a new value (ms), ``None`` if unknown
+
+        Funding periods vary between exchanges and markets and are taken
+        from the spacing of the last two ``points``.
+        '''
+        if series == 'open_interest':
+            return self.get_timeframe_ms(self.get_open_interest_period(timeframe))
+        if series == 'funding_rate':
+            return points[-1][0] - points[-2][0] if len(points) > 1 else None
+        return self.get_timeframe_ms(timeframe)
+
+    def _fetch_history(self, fetch, keys, since, until):
+        '''Pages through a ccxt history endpoint returning dicts with a ``timestamp``'''
+        points = []
+        while since < until:
+            page = [entry for entry in fetch(since) if (entry.get('timestamp') or 0) >= since]
+            if not page:
+                break
+            for entry in page:
+                value = next((entry[key] for key in keys if entry.get(key) is not None), None)
+                if value is not None and entry['timestamp'] < until:
+                    points.append((entry['timestamp'], float(value)))
+            since = max(entry['timestamp'] for entry in page) + 1
+        return sorted(points)
+
+    def fetch_derivative_grid(self, series, symbol, timeframe, since, count):
+        '''Returns ``[[timestamp, value], ...]`` of a derivatives series on the bar grid
+
+        Used to cache the series next to the candles: one row per bar from
+        ``since`` (as of alignment), none for bars in the future or before
+        the first value.
+        '''
+        duration = self.get_timeframe_ms(timeframe)
+        end = min(since + count * duration, int(time.time() * 1000) + 1)
+        grid = range(since, end, duration)
+        if not grid:
+            return []
+        points = self.fetch_derivative_history(series, symbol, timeframe, since, grid[-1] + 1)
+        return [[ts, value] for ts, value in zip(grid, align_asof(points, grid)) if value == value]
+
     def retry(method):
         @wraps(method)
         def retry_method(self, *args, **kwargs):
+            metrics = self.metrics
             for i in range(self.retries):
-                if self.debug:
-                    print('{} - {} - Attempt {}'.format(datetime.now(), method.__name__, i))
-                time.sleep(self.exchange.rateLimit / 1000)
+                delay = self.exchange.rateLimit / 1000
+                time.sleep(delay)
+                if metrics is None:
+                    try:
+                        return method(self, *args, **kwargs)
+                    except self._retry_errors as e:
+                        if isinstance(e, self._final_errors) or i == self.retries - 1:
+                            raise
+                        log.warning('request_retry', method=method.__name__, attempt=i, error=e)
+                    continue
+
+                self.exchange.last_http_response = None
+                start = time.perf_counter()
                 try:
-                    return method(self, *args, **kwargs)
-                except (NetworkError, ExchangeError):
-                    if i == self.retries - 1:
+                    ret = method(self, *args, **kwargs)
+                except Exception as e:
+                    metrics.record(method.__name__, time.perf_counter() - start, delay, i, error=e)
+                    if not isinstance(e, self._retry_errors) or isinstance(e, self._final_errors) or \
+                            i == self.retries - 1:
                         raise
+                    log.warning('request_retry', method=method.__name__, attempt=i, error=e)
+                else:
+                    metrics.record(method.__name__, time.perf_counter() - start, delay, i,
+                                   nbytes=len(self.exchange.last_http_response or ''))
+                    return ret
 
         return retry_method
 
+    @retry
+    def load_markets(self, reload=False):
+        return self.exchange.load_markets(reload)
+
+    def get_market_index(self, reload=False):
+        '''Returns the ``MarketIndex`` of the exchange markets, loading them once'''
+        if self._market_index is None or reload:
+            from ccxt.base.decimal_to_precision import TICK_SIZE
+            from .cryptomarkets import MarketIndex
+            markets = self.load_markets(reload) or {}
+            self._market_index = MarketIndex(markets, getattr(self.exchange, 'precisionMode', TICK_SIZE))
+        return self._market_index
+
     @retry
     def get_wallet_balance(self, currency, params=None):
         balance = self.exchange.fetch_balance(params)
@@ -155,23 +478,30 @@ class CryptoStore(with_metaclass(MetaSingleton, object)):
     @retry
     def get_balance(self):
         balance = self.exchange.fetch_balance()
+        self._balance = balance
 
         cash = balance['free'][self.currency]
         value = balance['total'][self.currency]
         # Fix if None is returned
         self._cash = cash if cash else 0
         self._value = value if value else 0
+        return balance
 
     @retry
     def get_position(self):
         return self._value
         # return self.getvalue(currency)
 
-    @retry
     def create_order(self, symbol, order_type, side, amount, price, params):
+        # The interceptor runs outside of the retry wrapper: it is neither
+        # delayed by the rate limit nor called again if it raises
         if self.order_interceptor is not None:
             self.order_interceptor(symbol, order_type, side, amount, price, params)
             return None
+        return self._create_order(symbol, order_type, side, amount, price, params)
+
+    @retry
+    def _create_order(self, symbol, order_type, side, amount, price, params):
         # returns the order
         return self.exchange.create_order(symbol=symbol, type=order_type, side=side,
                                           amount=amount, price=price, params=params)
@@ -185,16 +515,34 @@ class CryptoStore(with_metaclass(MetaSingleton, object)):
     def cancel_order(self, order_id, symbol):
         return self.exchange.cancel_order(order_id, symbol)
 
+    @retry
+    def cancel_orders(self, order_ids, symbol):
+        return self.exchange.cancel_orders(order_ids, symbol)
+
+    @retry
+    def cancel_all_orders(self, symbol=None):
+        return self.exchange.cancel_all_orders(symbol)
+
     @retry
     def fetch_trades(self, symbol):
         return self.exchange.fetch_trades(symbol)
 
+    @retry
+    def fetch_order_book(self, symbol, limit=None, params={}):
+        return self.exchange.fetch_order_book(symbol, limit=limit, params=params)
+
+    @retry
+    def fetch_funding_rate_history(self, symbol, since=None, limit=None, params={}):
+        return self.exchange.fetch_funding_rate_history(symbol, since=since, limit=limit, params=params)
+
+    @retry
+    def fetch_open_interest_history(self, symbol, timeframe='1h', since=None, limit=None, params={}):
+        return self.exchange.fetch_open_interest_history(symbol, timeframe=timeframe, since=since, limit=limit,
+                                                         params=params)
+
     @retry
     def fetch_ohlcv(self, symbol, timeframe, since, limit, params={}):
-        if self.debug:
-            since_dt = datetime.utcfromtimestamp(since // 1000) if since is not None else 'NA'
-            print('Fetching: {}, timeframe:{}, since TS:{}, since_dt:{}, limit:{}, params:{}'.format(
-                symbol, timeframe, since, since_dt, limit, params))
+        log.debug('fetch_ohlcv', symbol=symbol, timeframe=timeframe, since=since, limit=limit, params=params)
         return self.exchange.fetch_ohlcv(symbol, timeframe=timeframe, since=since, limit=limit, params=params)
 
     @retry
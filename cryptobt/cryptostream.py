@@ -0,0 +1,167 @@
+import threading
+import time
+
+from .cryptolog import get_logger, set_debug
+
+log = get_logger('stream')
+
+
+class OrderStream(object):
+    '''Base class of the private order update streams of ``CryptoBroker``.
+
+    An adapter runs in a daemon thread and reports every update of the
+    account orders as a ccxt order dict through ``_order``. Once updates flow
+    again after a disconnection it calls ``_reconnected``: the updates sent
+    in between may have been lost and the broker resyncs its open orders over
+    REST.
+
+    Subclasses implement ``_run`` (which must return soon after ``_stop`` is
+    set) and, if ``_run`` can block, ``_interrupt`` to wake it up. An
+    exception raised by ``_run`` is kept in ``error`` and stops the thread.
+    '''
+
+    def __init__(self, debug=False):
+        self.debug = debug
+        if debug:
+            set_debug(log)
+        self.on_order = None
+        self.on_reconnect = None
+        self.error = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, on_order, on_reconnect):
+        self.on_order = on_order
+        self.on_reconnect = on_reconnect
+        self.error = None
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._main, name='cryptobt-order-stream', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._interrupt()
+        self._thread.join()
+        self._thread = None
+
+    def _main(self):
+        try:
+            self._run()
+        except Exception as e:
+            self.error = e
+
+    def _run(self):
+        raise NotImplementedError
+
+    def _interrupt(self):
+        pass
+
+    def _order(self, ccxt_order):
+        self.on_order(ccxt_order)
+
+    def _reconnected(self):
+        log.info('order_stream_reconnected')
+        self.on_reconnect()
+
+
+class CcxtProOrderStream(OrderStream):
+    '''Order updates from the ccxt.pro ``watch_orders`` websocket channel.
+
+    ``exchange`` and ``config`` are the ones given to ``CryptoStore``: a
+    separate ccxt.pro instance is created with the same credentials and run
+    in an asyncio loop of its own. ``symbols`` restricts the subscriptions
+    (some exchanges require a symbol), all the account orders are watched if
+    not given. Network errors are retried every ``reconnect_delay`` seconds.
+    '''
+
+    def __init__(self, exchange, config, symbols=None, reconnect_delay=1.0, debug=False):
+        super(CcxtProOrderStream, self).__init__(debug=debug)
+        self.exchange = exchange
+        self.config = config
+        self.symbols = symbols
+        self.reconnect_delay = reconnect_delay
+        self._loop = None
+        self._task = None
+
+    def _run(self):
+        import asyncio
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._task = self._loop.create_task(self._watch())
+            self._loop.run_until_complete(self._task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._loop.close()
+
+    def _interrupt(self):
+        if self._loop is not None and self._task is not None:
+            self._loop.call_soon_threadsafe(self._task.cancel)
+
+    async def _watch(self):
+        import asyncio
+        import ccxt.pro
+        exchange = getattr(ccxt.pro, self.exchange)(self.config)
+        try:
+            await asyncio.gather(*[self._watch_symbol(exchange, symbol) for symbol in self.symbols or [None]])
+        finally:
+            await exchange.close()
+
+    async def _watch_symbol(self, exchange, symbol):
+        import asyncio
+        from ccxt.base.errors import NetworkError
+        disconnected = False
+        while not self._stop.is_set():
+            try:
+                orders = await exchange.watch_orders(symbol)
+            except NetworkError as e:
+                log.warning('order_stream_error', exchange=self.exchange, symbol=symbol, error=e)
+                disconnected = True
+                await asyncio.sleep(self.reconnect_delay)
+                continue
+            if disconnected:
+                disconnected = False
+                self._reconnected()
+            for order in orders:
+                self._order(order)
+
+
+class SimulatedOrderStream(OrderStream):
+    '''Local stand-in of a private order stream, for ``SimulatedExchange``.
+
+    Forwards the order updates published by the exchange and, every
+    ``interval`` seconds, lets it match the open orders against its price
+    (as an exchange matching engine would, without any ``fetch_order``).
+    ``disconnect(duration)`` drops the updates for ``duration`` seconds, to
+    test the resync after a reconnection.
+    '''
+
+    def __init__(self, exchange, interval=0.05, debug=False):
+        super(SimulatedOrderStream, self).__init__(debug=debug)
+        self.exchange = exchange
+        self.interval = interval
+        self._down_until = None
+
+    def disconnect(self, duration):
+        self._down_until = time.time() + duration
+
+    def _publish(self, ccxt_order):
+        if self._down_until is None:
+            self._order(ccxt_order)
+
+    def start(self, on_order, on_reconnect):
+        super(SimulatedOrderStream, self).start(on_order, on_reconnect)
+        self.exchange.subscribe_orders(self._publish)
+
+    def stop(self):
+        super(SimulatedOrderStream, self).stop()
+        self.exchange.unsubscribe_orders(self._publish)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if self._down_until is not None and time.time() >= self._down_until:
+                self._down_until = None
+                self._reconnected()
+            self.exchange.match_orders()
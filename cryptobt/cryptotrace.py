@@ -0,0 +1,170 @@
+import collections
+import threading
+import time
+
+import backtrader as bt
+
+Span = collections.namedtuple('Span', 'trace stage start end order_id')
+
+
+class LatencyTracer(object):
+    '''Bar-to-order latency tracer.
+
+    Enable with ``CryptoStore(..., tracer=True)`` (or pass an instance to size
+    the ring buffer) and add ``TraceAnalyzer`` to Cerebro to time the strategy.
+
+    Every live bar is a trace identified by ``(symbol, timestamp)``. Each
+    stage it goes through is recorded as a span from the end of the previous
+    stage to the current time:
+
+      - ``exchange``: from the candle closing on the exchange to the feed
+        receiving it in ``_fetch_ohlcv``
+      - ``queue``: waiting in the feed queue until ``_load_ohlcv`` delivers it
+      - ``broker``: ``CryptoBroker.next`` polling the open orders
+      - ``strategy``: the strategy ``next`` (until an order is submitted and
+        after the last one)
+      - ``order``: ``create_order`` including rate-limit sleeps and retries,
+        until the exchange acknowledges the order
+      - ``bar_to_ack``: the end-to-end time from the candle close to the
+        order acknowledgement
+
+    Spans are kept in a ring buffer of ``maxlen`` entries and summarised by
+    ``report``.
+    '''
+
+    STAGES = ('exchange', 'queue', 'broker', 'strategy', 'order', 'bar_to_ack')
+
+    def __init__(self, maxlen=100000):
+        self.spans = collections.deque(maxlen=maxlen)
+        self._marks = collections.OrderedDict()  # trace -> end of its last stage
+        self._closes = {}  # trace -> bar close time
+        self._current = {}  # symbol -> trace of the bar being processed
+        self._pending = set()  # delivered traces the broker hasn't seen yet
+        self._active = set()  # delivered traces the strategy hasn't finished yet
+        self._lock = threading.Lock()
+        self._maxtraces = 1024
+
+    def _span(self, trace, stage, end, order_id=None):
+        start = self._marks.get(trace)
+        if start is None:
+            return
+        self.spans.append(Span(trace, stage, start, end, order_id))
+        self._marks[trace] = end
+
+    def bar_received(self, symbol, tstamp, close_time):
+        '''Called by the feed when a new bar arrives. ``close_time`` is in epoch seconds'''
+        now = time.time()
+        trace = (symbol, tstamp)
+        with self._lock:
+            self._marks[trace] = close_time
+            self._closes[trace] = close_time
+            self._span(trace, 'exchange', now)
+            while len(self._marks) > self._maxtraces:
+                old, _ = self._marks.popitem(last=False)
+                self._closes.pop(old, None)
+
+    def bar_delivered(self, symbol, tstamp):
+        trace = (symbol, tstamp)
+        with self._lock:
+            if trace in self._marks:
+                self._current[symbol] = trace
+                self._pending.add(trace)
+                self._active.add(trace)
+                self._span(trace, 'queue', time.time())
+
+    def broker_done(self):
+        '''Called at the end of ``CryptoBroker.next``: closes the broker stage of new bars'''
+        now = time.time()
+        with self._lock:
+            for trace in self._pending:
+                self._span(trace, 'broker', now)
+            self._pending.clear()
+
+    def strategy_done(self):
+        '''Called after the strategy ``next``: closes the strategy stage of new bars'''
+        now = time.time()
+        with self._lock:
+            for trace in self._active:
+                self._span(trace, 'strategy', now)
+            self._active.clear()
+
+    def order_sent(self, symbol):
+        '''Called right before ``create_order``: closes the strategy stage so far'''
+        with self._lock:
+            trace = self._current.get(symbol)
+            if trace in self._active:
+                self._span(trace, 'strategy', time.time())
+
+    def order_acked(self, symbol, order_id):
+        now = time.time()
+        with self._lock:
+            trace = self._current.get(symbol)
+            if trace not in self._active or trace not in self._marks:
+                return
+            self._span(trace, 'order', now, order_id)
+            self.spans.append(Span(trace, 'bar_to_ack', self._closes[trace], now, order_id))
+
+    def clear(self):
+        with self._lock:
+            self.spans.clear()
+            self._marks.clear()
+            self._closes.clear()
+            self._current.clear()
+            self._pending.clear()
+            self._active.clear()
+
+    def report(self, percentiles=(50, 90, 99)):
+        '''Summarises the buffered spans per stage
+
+        Spans of the same stage and trace (e.g. the strategy before and after
+        submitting an order) are added up first. Returns a dict mapping each
+        stage to ``count``, ``mean``, ``max`` and ``pNN`` values in seconds.
+        '''
+        with self._lock:
+            spans = list(self.spans)
+
+        durations = collections.defaultdict(float)
+        for span in spans:
+            key = (span.stage, span.trace, span.order_id if span.stage in ('order', 'bar_to_ack') else None)
+            durations[key] += span.end - span.start
+
+        per_stage = collections.defaultdict(list)
+        for (stage, _, _), duration in durations.items():
+            per_stage[stage].append(duration)
+
+        report = collections.OrderedDict()
+        for stage in self.STAGES:
+            values = sorted(per_stage.get(stage, ()))
+            if not values:
+                continue
+            summary = dict(count=len(values), mean=sum(values) / len(values), max=values[-1])
+            for p in percentiles:
+                summary['p%d' % p] = values[min(len(values) - 1, int(len(values) * p / 100.0))]
+            report[stage] = summary
+
+        return report
+
+
+class TraceAnalyzer(bt.Analyzer):
+    '''Closes the ``strategy`` stage of the store tracer after every ``next``
+
+    ``get_analysis`` returns ``LatencyTracer.report()``.
+    '''
+
+    def start(self):
+        self.tracer = None
+        for data in self.datas:
+            store = getattr(data, 'store', None)
+            if store is not None and getattr(store, 'tracer', None) is not None:
+                self.tracer = store.tracer
+                break
+
+    def next(self):
+        if self.tracer is not None:
+            self.tracer.strategy_done()
+
+    def prenext(self):
+        self.next()
+
+    def get_analysis(self):
+        return self.tracer.report() if self.tracer is not None else {}
@@ -0,0 +1,133 @@
+import gzip
+import json
+import time
+import zlib
+from collections import defaultdict, deque
+
+import ccxt
+from ccxt.base import errors as ccxt_errors
+
+# Unified and implicit ccxt methods that go over the network
+_RECORDED_PREFIXES = ('fetch', 'create', 'cancel', 'edit', 'load_markets', 'private', 'public')
+
+
+def _is_recorded(name):
+    return name.startswith(_RECORDED_PREFIXES)
+
+
+def _request_key(name, args, kwargs):
+    return json.dumps([name, list(args), kwargs], sort_keys=True, default=str)
+
+
+class ReplayMismatch(LookupError):
+    '''Raised when a replayed session receives a request that was never recorded'''
+
+
+class RecordingExchange(object):
+    '''Transparent proxy around a ccxt exchange recording every request.
+
+    Each call to a network method is appended to ``path`` as a gzip compressed
+    JSON line holding the method name, its arguments, the result (or the
+    exception class and message), the start offset and the duration. The
+    first line holds the exchange id and the attributes needed for replay.
+    '''
+
+    def __init__(self, exchange, path):
+        object.__setattr__(self, '_exchange', exchange)
+        object.__setattr__(self, '_file', gzip.open(path, 'wb'))
+        object.__setattr__(self, '_started', time.time())
+        self._write(dict(exchange=exchange.id, rateLimit=exchange.rateLimit,
+                         has=exchange.has, timeframes=exchange.timeframes, started=self._started))
+
+    def _write(self, record):
+        self._file.write((json.dumps(record, default=str) + '\n').encode('utf-8'))
+        self._file.flush(zlib.Z_SYNC_FLUSH)  # keep the file readable if the process dies
+
+    def __getattr__(self, name):
+        attr = getattr(self._exchange, name)
+        if not callable(attr) or not _is_recorded(name):
+            return attr
+
+        def recorded(*args, **kwargs):
+            start = time.time()
+            record = dict(method=name, key=_request_key(name, args, kwargs), offset=start - self._started)
+            try:
+                result = attr(*args, **kwargs)
+            except ccxt_errors.BaseError as e:
+                record.update(duration=time.time() - start, error=type(e).__name__, message=str(e))
+                self._write(record)
+                raise
+            record.update(duration=time.time() - start, result=result)
+            self._write(record)
+            return result
+
+        return recorded
+
+    def __setattr__(self, name, value):
+        setattr(self._exchange, name, value)
+
+    def close(self):
+        self._file.close()
+
+
+class ReplayExchange(object):
+    '''Local stand-in exchange serving a session recorded by ``RecordingExchange``.
+
+    Requests are matched on method name and arguments and answered in the
+    recorded order. Errors are raised again with their original ccxt class.
+    With ``realtime`` each response is delayed by its recorded duration,
+    otherwise responses are immediate and the rate limit is set to zero so
+    ``CryptoStore`` doesn't sleep between calls.
+
+    Non network helpers (``parse_timeframe``, ``market`` ...) are served by an
+    offline instance of the recorded exchange class.
+    '''
+
+    def __init__(self, path, realtime=False):
+        with gzip.open(path, 'rt') as f:
+            header = json.loads(f.readline())
+            records = [json.loads(line) for line in f if line.strip()]
+
+        self._exchange = getattr(ccxt, header['exchange'])()
+        self._exchange.has = header['has']
+        self._exchange.timeframes = header['timeframes']
+        self._exchange.rateLimit = header['rateLimit'] if realtime else 0
+        self.realtime = realtime
+
+        self._responses = defaultdict(deque)
+        for record in records:
+            self._responses[record['key']].append(record)
+
+    def __getattr__(self, name):
+        if not _is_recorded(name):
+            return getattr(self._exchange, name)
+
+        def replayed(*args, **kwargs):
+            key = _request_key(name, args, kwargs)
+            responses = self._responses.get(key)
+            if not responses:
+                raise ReplayMismatch('No recorded response for %s' % key)
+            record = responses.popleft()
+
+            if self.realtime:
+                time.sleep(record['duration'])
+
+            if 'error' in record:
+                error_cls = getattr(ccxt_errors, record['error'], ccxt_errors.ExchangeError)
+                raise error_cls(record['message'])
+
+            if name == 'load_markets':
+                self._exchange.set_markets(record['result'])
+            return record['result']
+
+        return replayed
+
+    def __setattr__(self, name, value):
+        if name.startswith('_') or name == 'realtime':
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._exchange, name, value)
+
+    def remaining(self):
+        '''Returns the number of recorded responses not replayed yet'''
+        return sum(len(responses) for responses in self._responses.values())
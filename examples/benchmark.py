@@ -0,0 +1,243 @@
+'''Benchmarks of the cryptobt feed and broker hot paths against a SimulatedExchange.
+
+Run from the examples folder:
+
+    python benchmark.py --output baseline.json
+    python benchmark.py --compare baseline.json --tolerance 0.25
+
+Every benchmark reports a single rate (higher is better) or cost (lower is
+better). With ``--compare`` the script exits with status 1 if any result is
+worse than the baseline by more than ``tolerance``.
+
+``import_cryptobt`` also fails if ``import cryptobt`` loads ccxt or backtrader,
+which must only be imported once they are used.
+'''
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import backtrader as bt
+from cryptobt import CryptoStore, configure_logging
+
+
+def new_store(cache_params=None, **sim_params):
+    # CryptoStore is a singleton: every benchmark gets a fresh one
+    CryptoStore._singleton = None
+    return CryptoStore(exchange='simulated', currency='USDT', config={}, retries=3,
+                       cache_params=cache_params,
+                       transport_params=dict(mode='simulate', **sim_params))
+
+
+class Noop(bt.Strategy):
+    pass
+
+
+def run_historical(store, days, ohlcv_limit):
+    end = datetime(2022, 1, 1)
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.addstrategy(Noop)
+    data = store.getdata(dataname='BTC/USDT', timeframe=bt.TimeFrame.Minutes, compression=1,
+                         fromdate=end - timedelta(days=days), todate=end,
+                         ohlcv_limit=ohlcv_limit, historical=True)
+    cerebro.adddata(data)
+    start = time.perf_counter()
+    strat = cerebro.run()[0]
+    return len(strat.data), time.perf_counter() - start
+
+
+def bench_historical(days, cached):
+    if not cached:
+        bars, elapsed = run_historical(new_store(), days, ohlcv_limit=1000)
+        return dict(unit='bars/s', higher_is_better=True, value=bars / elapsed, bars=bars)
+
+    cache_dir = tempfile.mkdtemp(prefix='cryptobt-bench-')
+    try:
+        params = dict(basedir=cache_dir, limit=1000, block_size=6000)
+        run_historical(new_store(cache_params=params), days, ohlcv_limit=1000)  # warm the cache
+        bars, elapsed = run_historical(new_store(cache_params=params), days, ohlcv_limit=1000)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return dict(unit='bars/s', higher_is_better=True, value=bars / elapsed, bars=bars)
+
+
+def bench_historical_logged(days):
+    # every event at DEBUG level, formatted as JSON in the background
+    with open(os.devnull, 'w') as devnull:
+        handler = configure_logging(level=logging.DEBUG, stream=devnull)
+        try:
+            bars, elapsed = run_historical(new_store(), days, ohlcv_limit=1000)
+        finally:
+            logging.getLogger('cryptobt').removeHandler(handler)
+            logging.getLogger('cryptobt').setLevel(logging.NOTSET)
+            handler.close()
+    return dict(unit='bars/s', higher_is_better=True, value=bars / elapsed, bars=bars, dropped=handler.dropped)
+
+
+def bench_live_poll(seconds):
+    store = new_store()
+    data = store.getdata(dataname='BTC/USDT', timeframe=bt.TimeFrame.Minutes, compression=1,
+                         ohlcv_limit=20)
+    data._state = data._ST_LIVE
+    requests = store.exchange.requests
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        data._fetch_ohlcv()
+        data._data.clear()
+    elapsed = time.perf_counter() - start
+    return dict(unit='requests/s', higher_is_better=True,
+                value=(store.exchange.requests - requests) / elapsed)
+
+
+class PlaceOrders(bt.Strategy):
+    params = (('orders', 0),)
+
+    def next(self):
+        if len(self) == 1:
+            for i in range(self.p.orders):
+                # far away from the market: stays open for the whole run
+                self.buy(size=0.01, price=1000.0 + i, exectype=bt.Order.Limit)
+
+
+class TimedBroker(object):
+    '''Times ``next`` of the wrapped broker'''
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.elapsed = 0.0
+        self.calls = 0
+        orig = broker.next
+
+        def next():
+            start = time.perf_counter()
+            orig()
+            self.elapsed += time.perf_counter() - start
+            self.calls += 1
+
+        broker.next = next
+
+
+def bench_broker_next(open_orders, bars=200):
+    store = new_store(fill_mode='never')
+    broker = store.getbroker()
+    broker.get_balance()
+    timer = TimedBroker(broker)
+
+    end = datetime(2022, 1, 1)
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.setbroker(broker)
+    cerebro.addstrategy(PlaceOrders, orders=open_orders)
+    cerebro.adddata(store.getdata(dataname='BTC/USDT', timeframe=bt.TimeFrame.Minutes, compression=1,
+                                  fromdate=end - timedelta(minutes=bars), todate=end,
+                                  ohlcv_limit=1000, historical=True))
+    cerebro.run()
+    return dict(unit='us/call', higher_is_better=False, value=timer.elapsed / timer.calls * 1e6,
+                open_orders=len(broker.open_orders))
+
+
+def bench_retry_overhead(calls):
+    store = new_store()
+    exchange = store.exchange
+
+    start = time.perf_counter()
+    for _ in range(calls):
+        exchange.fetch_ohlcv('BTC/USDT', timeframe='1m', since=0, limit=1, params={})
+    direct = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(calls):
+        store.fetch_ohlcv('BTC/USDT', timeframe='1m', since=0, limit=1, params={})
+    wrapped = time.perf_counter() - start
+
+    return dict(unit='us/call', higher_is_better=False, value=(wrapped - direct) / calls * 1e6)
+
+
+IMPORT_CHECK = '''
+import sys, time
+start = time.perf_counter()
+import cryptobt
+elapsed = time.perf_counter() - start
+heavy = sorted(m for m in sys.modules if m.split('.')[0] in ('ccxt', 'backtrader', 'tscache'))
+print(elapsed, ' '.join(heavy))
+'''
+
+
+def bench_import(runs):
+    # every run is a fresh interpreter: the minimum is the least noisy
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), os.environ.get('PYTHONPATH')])))
+    timings = []
+    for _ in range(runs):
+        out = subprocess.check_output([sys.executable, '-c', IMPORT_CHECK], env=env, universal_newlines=True)
+        elapsed, _, modules = out.strip().partition(' ')
+        timings.append(float(elapsed))
+    return dict(unit='ms', higher_is_better=False, value=min(timings) * 1000, unexpected_modules=modules.split())
+
+
+def run(quick=False):
+    scale = 0.2 if quick else 1.0
+    results = {}
+    results['import_cryptobt'] = bench_import(runs=3 if quick else 10)
+    results['historical_uncached'] = bench_historical(days=max(1, int(7 * scale)), cached=False)
+    results['historical_cached'] = bench_historical(days=max(1, int(7 * scale)), cached=True)
+    results['historical_debug_logging'] = bench_historical_logged(days=max(1, int(7 * scale)))
+    results['live_poll'] = bench_live_poll(seconds=2 * scale)
+    for n in (0, 10, 100):
+        results['broker_next_%d_orders' % n] = bench_broker_next(n)
+    results['retry_overhead'] = bench_retry_overhead(calls=int(20000 * scale))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in sorted(results.items()):
+        if result.get('unexpected_modules'):
+            print('{:<28} imports {}'.format(name, ', '.join(result['unexpected_modules'])))
+            regressions.append(name)
+            continue
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        if result['higher_is_better']:
+            ratio = result['value'] / base['value'] if base['value'] else 1.0
+            regressed = ratio < 1.0 - tolerance
+        else:
+            ratio = base['value'] / result['value'] if result['value'] else 1.0
+            regressed = ratio < 1.0 - tolerance
+        print('{:<28} {:>14.2f} {:<10} baseline {:>14.2f} {}'.format(
+            name, result['value'], result['unit'], base['value'], 'REGRESSION' if regressed else 'ok'))
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', help='write the results as a JSON baseline to this file')
+    parser.add_argument('--compare', help='JSON baseline to compare the results with')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative slowdown')
+    parser.add_argument('--quick', action='store_true', help='smaller workloads, for smoke runs')
+    args = parser.parse_args()
+
+    results = run(quick=args.quick)
+
+    for name, result in sorted(results.items()):
+        print('{:<28} {:>14.2f} {}'.format(name, result['value'], result['unit']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(dict(created=datetime.utcnow().isoformat(), python=platform.python_version(),
+                           platform=platform.platform(), results=results), f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
@@ -1,4 +1,4 @@
-from cryptobt import CryptoStore
+from cryptobt import CryptoStore, OrderDispatcher
 import backtrader as bt
 import json
 import os
@@ -58,28 +58,42 @@ if __name__ == "__main__":
     if live:
         # Install docker and run following commands to start rabbitmq
         # docker run -it --rm --name rabbitmq -p 5672:5672 -p 15672:15672 rabbitmq:3.9-management
-        connection = pika.BlockingConnection(
-            pika.ConnectionParameters(host='localhost'))
-        channel = connection.channel()
-        channel.exchange_declare(exchange='orders', exchange_type='fanout')
+        # pika connections are not thread safe: the connection is opened by
+        # the dispatcher worker thread, the only one publishing
+        rabbitmq = {}
 
-        def order_interceptor(symbol, order_type, side, amount, price, params):
-            print("INTERCEPTED ORDER:", symbol, order_type, side, amount, price, params)
-            message = json.dumps({
-                "symbol": symbol,
-                "order_type": order_type,
-                "side": side,
-                "amount": amount,
-                "price": price,
-                "param": params
-            })
-            channel.basic_publish(exchange='orders', routing_key='', body=message)
+        def publish(orders):
+            # Runs on the dispatcher worker thread, off the critical path of next()
+            channel = rabbitmq.get('channel')
+            if channel is None or channel.is_closed:
+                # (re)connects: an idle blocking connection misses its heartbeats
+                connection = pika.BlockingConnection(pika.ConnectionParameters(host='localhost'))
+                channel = connection.channel()
+                channel.exchange_declare(exchange='orders', exchange_type='fanout')
+                rabbitmq.update(connection=connection, channel=channel)
+            for order in orders:
+                print("INTERCEPTED ORDER:", order)
+                message = json.dumps({
+                    "symbol": order["symbol"],
+                    "order_type": order["order_type"],
+                    "side": order["side"],
+                    "amount": order["amount"],
+                    "price": order["price"],
+                    "param": order["params"]
+                })
+                channel.basic_publish(exchange='orders', routing_key='', body=message)
+
+        order_interceptor = OrderDispatcher(publish, batch_size=10, backpressure='spill',
+                                            spill_path='orders_spill.jsonl', debug=True)
 
         start(config, "BTC-PERPETUAL",
               strategy=TestStrategy, start=datetime.now() - timedelta(minutes=12*60),
               timeframe=bt.TimeFrame.Minutes, compression=1, debug=True, order_interceptor=order_interceptor)
 
-        connection.close()
+        order_interceptor.close()  # the worker thread is done with the connection once joined
+        print("Order dispatch:", order_interceptor.metrics())
+        if rabbitmq.get('connection') is not None and rabbitmq['connection'].is_open:
+            rabbitmq['connection'].close()
     else:
         start(config, "BTC-PERPETUAL",
               strategy=TestStrategy, start=datetime(2022, 1, 1), end=datetime(2022, 2, 1),
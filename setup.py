@@ -10,4 +10,5 @@ setup(
    license='MIT',
    packages=['cryptobt'],  
    install_requires=['backtrader', 'ccxt', 'tscache'],
+   extras_require={'arrow': ['pyarrow']},
 )
\ No newline at end of file
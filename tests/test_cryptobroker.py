@@ -0,0 +1,172 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+import backtrader as bt
+
+from cryptobt import CryptoStore
+from cryptobt.cryptobroker import CryptoOrder
+from cryptobt.cryptocheckpoint import Checkpoint
+
+
+def trade(tid, amount, price):
+    return dict(id=tid, amount=amount, price=price, datetime=None, fee=None)
+
+
+def partial_fill(exchange, oid, tid, amount, price):
+    '''Fills ``amount`` of an open order of a SimulatedExchange (which only fills orders at once)'''
+    order = exchange.orders[oid]
+    order['trades'].append(dict(trade(tid, amount, price), order=oid, symbol=order['symbol'], side=order['side'],
+                                cost=amount * price))
+    order['filled'] += amount
+    order['remaining'] -= amount
+    order['cost'] += amount * price
+
+
+class ProcessFillsTest(unittest.TestCase):
+
+    def setUp(self):
+        CryptoStore._singleton = None
+        self.store = CryptoStore('simulated', 'USDT', {}, 1, cache_params=None,
+                                 transport_params=dict(mode='simulate', fill_mode='never'))
+        self.broker = self.store.getbroker()
+
+        # a feed with a bar, which backtrader orders need
+        end = datetime(2022, 1, 1)
+        self.data = self.store.getdata(dataname='BTC/USDT', timeframe=bt.TimeFrame.Minutes, compression=1,
+                                       fromdate=end - timedelta(minutes=5), todate=end, historical=True)
+        cerebro = bt.Cerebro(stdstats=False)
+        cerebro.adddata(self.data)
+        cerebro.addstrategy(bt.Strategy)
+        cerebro.run()
+
+        self.ccxt_order = self.store.exchange.create_order('BTC/USDT', 'limit', 'buy', 0.1, 100.0)
+        self.order = CryptoOrder(None, self.data, self.ccxt_order)
+        self.order.price = 100.0
+
+    def tearDown(self):
+        CryptoStore._singleton = None
+
+    def update(self, filled, trades):
+        self.broker._process_fills(self.order, dict(self.ccxt_order, filled=filled, cost=filled * 100.0,
+                                                    trades=trades))
+
+    def position(self):
+        return self.broker.ledger.getposition('BTC/USDT').size
+
+    def test_trades_are_applied_once(self):
+        self.update(0.05, [trade('t1', 0.05, 100.0)])
+        self.update(0.05, [trade('t1', 0.05, 100.0)])
+        self.update(0.1, [trade('t1', 0.05, 100.0), trade('t2', 0.05, 100.0)])
+
+        self.assertAlmostEqual(self.order.executed.size, 0.1)
+        self.assertAlmostEqual(self.position(), 0.1)
+        self.assertEqual(self.order.executed_fills, ['t1', 't2'])
+
+    def test_trades_of_a_cumulative_update_are_skipped(self):
+        # the order stream reports the cumulative fill, REST then lists its trades
+        self.update(0.05, [])
+        self.assertAlmostEqual(self.position(), 0.05)
+
+        self.update(0.1, [trade('t1', 0.05, 100.0), trade('t2', 0.05, 100.0)])
+        self.assertAlmostEqual(self.order.executed_amount, 0.1)
+        self.assertAlmostEqual(self.position(), 0.1)
+        self.assertEqual(self.order.executed_fills, ['t1', 't2'])
+
+    def test_cumulative_updates_price_the_new_part(self):
+        self.broker._process_fills(self.order, dict(self.ccxt_order, filled=0.05, cost=5.0, trades=[]))
+        self.broker._process_fills(self.order, dict(self.ccxt_order, filled=0.1, cost=10.5, trades=[]))
+
+        self.assertAlmostEqual(self.position(), 0.1)
+        self.assertAlmostEqual(self.order.executed_cost, 10.5)
+        self.assertAlmostEqual(self.broker.ledger.getposition('BTC/USDT').price, 105.0)
+
+
+class CheckpointTest(unittest.TestCase):
+    '''A live bot stopped with a partially filled order and started again'''
+
+    class Strategy(bt.Strategy):
+        params = (('exchange', None), ('place', False))
+
+        def __init__(self):
+            self.live = False
+            self.bars = []  # whether each bar was delivered live
+
+        def notify_data(self, data, status, *args, **kwargs):
+            if status == data.LIVE:
+                self.live = True
+                if not self.p.place:
+                    self.env.runstop()  # restarted: the backfill is done
+
+        def next(self):
+            self.bars.append(self.live)
+            if not self.p.place:
+                return
+
+            if len(self.bars) == 1:
+                self.order = self.buy(size=0.1, price=100.0, exectype=bt.Order.Limit)
+            elif len(self.bars) == 2:
+                partial_fill(self.p.exchange, self.order.ccxt_order['id'], 'fill-1', 0.04, 100.0)
+            elif len(self.bars) == 4:
+                self.env.runstop()
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'bot.ckpt')
+        self.exchange = None
+
+    def tearDown(self):
+        CryptoStore._singleton = None
+        shutil.rmtree(self.tmpdir)
+
+    def run_bot(self, place):
+        CryptoStore._singleton = None
+        store = CryptoStore('simulated', 'USDT', {}, 1, cache_params=None,
+                            transport_params=dict(mode='simulate', fill_mode='never'),
+                            checkpoint_params=dict(path=self.path, interval=3600, bars=50))
+        if self.exchange is None:
+            self.exchange = store.exchange
+        store.exchange = self.exchange  # the orders live on
+
+        broker = store.getbroker()
+        broker.get_balance()
+        cerebro = bt.Cerebro(stdstats=False)
+        cerebro.setbroker(broker)
+        cerebro.addstrategy(self.Strategy, exchange=self.exchange, place=place)
+        cerebro.adddata(store.getdata(dataname='BTC/USDT', timeframe=bt.TimeFrame.Minutes, compression=1))
+        return cerebro.run()[0], broker
+
+    def test_round_trip(self):
+        strategy, broker = self.run_bot(place=True)
+        self.assertAlmostEqual(broker.getposition(strategy.data).size, 0.04)
+
+        state = Checkpoint(self.path).load()
+        self.assertEqual(len(state['feeds']['BTC/USDT/1m']['bars']), 4)
+        saved, = state['broker']['open_orders']
+        self.assertEqual((saved['executed_fills'], saved['executed_amount']), (['fill-1'], 0.04))
+        self.assertEqual(state['broker']['positions']['BTC/USDT'][0], 0.04)
+
+        strategy, broker = self.run_bot(place=False)
+        # the saved bars come back as backfill, before the feed goes live
+        self.assertGreaterEqual(len(strategy.bars), 4)
+        self.assertNotIn(True, strategy.bars)
+        self.assertTrue(strategy.live)
+        # the open order is adopted with its fill, which is not applied twice
+        order, = broker.open_orders
+        self.assertEqual(order.ccxt_order['id'], saved['id'])
+        self.assertEqual(order.executed_fills, ['fill-1'])
+        self.assertAlmostEqual(broker.getposition(strategy.data).size, 0.04)
+
+    def test_saved_orders_unknown_to_the_exchange_are_dropped(self):
+        self.run_bot(place=True)
+        self.exchange = None  # a fresh exchange, which never saw the order
+
+        strategy, broker = self.run_bot(place=False)
+        self.assertEqual(broker.open_orders, [])
+        self.assertTrue(strategy.live)
+
+
+if __name__ == '__main__':
+    unittest.main()
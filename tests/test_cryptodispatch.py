@@ -0,0 +1,91 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from cryptobt.cryptodispatch import OrderDispatcher
+
+
+class GatedHandler(object):
+    '''Records the delivered messages, each batch waiting for a ``release``'''
+
+    def __init__(self):
+        self.delivered = []
+        self.gate = threading.Semaphore(0)
+        self.entered = threading.Semaphore(0)
+
+    def __call__(self, batch):
+        self.entered.release()
+        self.gate.acquire()
+        self.delivered.extend(message['n'] for message in batch)
+
+    def release(self, batches=1):
+        for _ in range(batches):
+            self.gate.release()
+
+    def wait_entered(self):
+        assert self.entered.acquire(timeout=5)
+
+
+class SpillOrderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.spill_path = os.path.join(self.tmpdir, 'spill.jsonl')
+        self.handler = GatedHandler()
+        self.dispatcher = OrderDispatcher(self.handler, maxsize=2, backpressure='spill',
+                                          spill_path=self.spill_path)
+
+    def tearDown(self):
+        self.handler.release(100)
+        self.dispatcher.close(timeout=5)
+        shutil.rmtree(self.tmpdir)
+
+    def put(self, *numbers):
+        for n in numbers:
+            self.dispatcher.put(dict(n=n, ts=0.0))
+
+    def test_fifo_across_spills(self):
+        self.put(0)
+        self.handler.wait_entered()  # 0 held by the handler
+        self.put(1, 2)               # queue full
+        self.put(3, 4, 5)            # spilled
+        self.assertTrue(os.path.isfile(self.spill_path))
+
+        self.handler.release(2)      # 0 and 1 delivered, 2 taken
+        self.handler.wait_entered()
+        self.handler.wait_entered()
+        # The queue has room again but 3, 4 and 5 are still spilled
+        self.put(6, 7)
+
+        self.handler.release(3)      # 2, 3 and 4 delivered, 5 taken
+        for _ in range(3):
+            self.handler.wait_entered()
+        self.put(8, 9, 10, 11)
+
+        self.handler.release(100)
+        self.assertTrue(self.dispatcher.flush(timeout=5))
+        self.assertEqual(self.handler.delivered, list(range(12)))
+        self.assertFalse(os.path.isfile(self.spill_path))
+
+        metrics = self.dispatcher.metrics()
+        self.assertEqual(metrics['delivered'], 12)
+        self.assertEqual(metrics['pending'], 0)
+
+    def test_queue_used_again_once_drained(self):
+        self.put(0)
+        self.handler.wait_entered()
+        self.put(1, 2, 3)            # 3 spilled
+        self.handler.release(100)
+        self.assertTrue(self.dispatcher.flush(timeout=5))
+
+        spilled = self.dispatcher.metrics()['spilled']
+        self.put(4)
+        self.assertTrue(self.dispatcher.flush(timeout=5))
+        self.assertEqual(self.dispatcher.metrics()['spilled'], spilled)
+        self.assertEqual(self.handler.delivered, list(range(5)))
+
+
+if __name__ == '__main__':
+    unittest.main()
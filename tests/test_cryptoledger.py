@@ -0,0 +1,94 @@
+import unittest
+
+from cryptobt import CryptoStore
+from cryptobt.cryptoledger import CryptoLedger
+
+CONTRACT = 'BTC/USDT:USDT'
+
+
+class LedgerTest(unittest.TestCase):
+
+    def setUp(self):
+        CryptoStore._singleton = None
+        self.store = CryptoStore('simulated', 'USDT', {}, 1, cache_params=None,
+                                 transport_params=dict(mode='simulate', balance={'USDT': 10000.0}))
+        self.exchange = self.store.exchange
+        self.exchange.markets[CONTRACT] = dict(self.exchange.markets['BTC/USDT'], symbol=CONTRACT,
+                                               type='swap', spot=False, contract=True)
+        self.drifts = []
+        self.ledger = CryptoLedger(self.store, balance=self.exchange.fetch_balance(), on_drift=self.drifts.append)
+
+    def tearDown(self):
+        CryptoStore._singleton = None
+
+    def fill(self, side, amount):
+        '''Fills an order on the exchange and applies its trade to the ledger'''
+        order = self.exchange.create_order('BTC/USDT', 'market', side, amount)
+        for trade in order['trades']:
+            self.ledger.apply_fill('BTC/USDT', trade['side'], trade['amount'], trade['price'], trade['fee'])
+        return order
+
+    def test_spot_fill_moves_both_assets_and_the_fee(self):
+        order = self.fill('buy', 0.1)
+        trade = order['trades'][0]
+
+        self.assertAlmostEqual(self.ledger.getvalue('BTC'), 0.1)
+        self.assertAlmostEqual(self.ledger.getvalue('USDT'), 10000.0 - trade['cost'] - trade['fee']['cost'])
+        position = self.ledger.getposition('BTC/USDT')
+        self.assertAlmostEqual(position.size, 0.1)
+        self.assertAlmostEqual(position.price, trade['price'])
+
+    def test_contract_fill_only_moves_the_position(self):
+        self.ledger.apply_fill(CONTRACT, 'sell', 2.0, 100.0, dict(cost=0.5, currency='USDT'))
+
+        self.assertEqual(self.ledger.getposition(CONTRACT).size, -2.0)
+        self.assertEqual(self.ledger.getvalue('BTC'), 0.0)
+        self.assertAlmostEqual(self.ledger.getvalue('USDT'), 10000.0 - 0.5)
+
+    def test_no_drift_after_fills(self):
+        self.fill('buy', 0.1)
+        self.fill('sell', 0.04)
+
+        drift = self.ledger.reconcile(positions=[])
+        self.assertEqual(drift, dict(balances={}, positions={}))
+        self.assertEqual(self.drifts, [])
+
+    def test_drift_is_reported_and_resynced(self):
+        self.fill('buy', 0.1)
+        self.exchange.balance['USDT'] += 50.0  # deposit
+        self.ledger.apply_fill(CONTRACT, 'buy', 1.0, 100.0)
+
+        drift = self.ledger.reconcile(positions=[dict(symbol=CONTRACT, contracts=3.0, side='long')])
+
+        local, remote = drift['balances']['USDT']
+        self.assertAlmostEqual(remote - local, 50.0)
+        self.assertEqual(drift['positions'], {CONTRACT: (1.0, 3.0)})
+        self.assertEqual(self.drifts, [drift])
+        self.assertAlmostEqual(self.ledger.getvalue('USDT'), self.exchange.balance['USDT'])
+        self.assertEqual(self.ledger.getposition(CONTRACT).size, 3.0)
+        self.assertAlmostEqual(self.ledger.getposition('BTC/USDT').size, 0.1)  # spot: checked on balances
+
+    def test_spot_position_above_the_holding(self):
+        self.fill('buy', 0.1)
+        self.exchange.balance['BTC'] = 0.06  # withdrawn
+
+        drift = self.ledger.reconcile(positions=[])
+        self.assertEqual(list(drift['positions']), ['BTC/USDT'])
+        self.assertAlmostEqual(drift['positions']['BTC/USDT'][1], 0.06)
+        self.assertAlmostEqual(self.ledger.getposition('BTC/USDT').size, 0.06)
+
+    def test_reconcile_skipped_when_a_fill_lands_during_the_requests(self):
+        fetch_balance = self.store.get_wallet_balance
+
+        def racing(currency, params=None):
+            self.ledger.apply_fill(CONTRACT, 'buy', 1.0, 100.0)
+            return fetch_balance(currency, params)
+
+        self.store.get_wallet_balance = racing
+        self.exchange.balance['USDT'] += 50.0
+        self.assertIsNone(self.ledger.reconcile(positions=[]))
+        self.assertEqual(self.drifts, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
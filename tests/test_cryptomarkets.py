@@ -0,0 +1,70 @@
+import unittest
+
+from ccxt.base.decimal_to_precision import DECIMAL_PLACES, SIGNIFICANT_DIGITS, TICK_SIZE
+from ccxt.base.errors import InvalidOrder
+
+from cryptobt.cryptomarkets import MarketIndex, MarketInfo
+from cryptobt.cryptosim import SimulatedExchange
+
+
+class SimulatedMarketTest(unittest.TestCase):
+    '''Rules of the SimulatedExchange markets: 1e-6 lots, 0.01 ticks, 5 USDT minimum notional'''
+
+    def setUp(self):
+        self.exchange = SimulatedExchange(symbols=('BTC/USDT', 'ETH/USDT'))
+        self.index = MarketIndex(self.exchange.load_markets(), TICK_SIZE)
+        self.info = self.index.get('BTC/USDT')
+
+    def test_index(self):
+        self.assertEqual(len(self.index), 2)
+        self.assertIn('ETH/USDT', self.index)
+        self.assertIsNone(self.index.get('XRP/USDT'))
+
+    def test_round_amount_truncates_to_the_lot(self):
+        self.assertEqual(self.info.round_amount(0.1234567), 0.123456)
+        self.assertEqual(self.info.round_amount(0.3), 0.3)  # exact multiples survive float noise
+
+    def test_round_price_to_the_nearest_tick(self):
+        self.assertEqual(self.info.round_price(30000.126), 30000.13)
+        self.assertEqual(self.info.round_price(30000.124), 30000.12)
+
+    def test_check_normalises(self):
+        self.assertEqual(self.info.check(0.0012345678, 30000.004), (0.001234, 30000.0))
+
+    def test_check_rejects(self):
+        with self.assertRaises(InvalidOrder):
+            self.info.check(0.0000001, 30000.0)  # rounds to zero
+        with self.assertRaises(InvalidOrder):
+            self.info.check(0.000005, 30000.0)  # below the minimum amount
+        with self.assertRaises(InvalidOrder):
+            self.info.check(0.0001, 30000.0)  # 3 USDT notional
+        with self.assertRaises(InvalidOrder):
+            self.info.check(0.0001, None, ref_price=30000.0)  # market order, at the reference price
+
+    def test_unknown_symbols_are_passed_through(self):
+        self.assertEqual(self.index.check('XRP/USDT', 0.1234567, 1.23456), (0.1234567, 1.23456))
+
+    def test_comminfo_charges_the_taker_fee(self):
+        comminfo = self.info.comminfo()
+        self.assertEqual(comminfo.p.commission, self.exchange.fee)
+        self.assertAlmostEqual(comminfo.getcommission(2.0, 100.0), 2.0 * 100.0 * self.exchange.fee)
+
+
+class PrecisionModeTest(unittest.TestCase):
+
+    def market(self, amount, price):
+        return dict(symbol='X/Y', precision=dict(amount=amount, price=price), limits={})
+
+    def test_decimal_places(self):
+        info = MarketInfo(self.market(3, 1), DECIMAL_PLACES)
+        self.assertEqual(info.round_amount(1.23456), 1.234)
+        self.assertEqual(info.round_price(99.96), 100.0)
+
+    def test_significant_digits(self):
+        info = MarketInfo(self.market(2, 3), SIGNIFICANT_DIGITS)
+        self.assertEqual(info.round_amount(0.0129), 0.012)
+        self.assertEqual(info.round_price(12345.0), 12300.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+from datetime import datetime, timedelta
+
+import backtrader as bt
+
+from cryptobt import CryptoStore
+from cryptobt.cryptoohlcv import OHLCVStats, align_asof, fill_gaps, validate_ohlcv
+from cryptobt.cryptosim import SimulatedExchange
+
+MINUTE = 60000
+
+
+def bar(ts, close=1.0, volume=1.0):
+    return [ts, close, close, close, close, volume]
+
+
+class ValidateTest(unittest.TestCase):
+
+    def test_drops_invalid_and_duplicates_and_sorts(self):
+        stats = OHLCVStats()
+        rows = [bar(2 * MINUTE), [MINUTE, 1.0, None, 1.0, 1.0, 1.0], bar(0), bar(2 * MINUTE, close=2.0), [3 * MINUTE]]
+        clean, gaps = validate_ohlcv(rows, MINUTE, stats=stats)
+
+        self.assertEqual(clean, [bar(0), bar(2 * MINUTE, close=2.0)])  # the last duplicate wins
+        self.assertEqual(gaps, [(MINUTE, 1)])
+        self.assertEqual((stats.rows, stats.invalid, stats.duplicates, stats.out_of_order), (3, 2, 1, 1))
+        self.assertEqual((stats.gaps, stats.missing), (1, 1))
+
+    def test_gap_after_the_last_delivered_bar(self):
+        clean, gaps = validate_ohlcv([bar(5 * MINUTE), bar(6 * MINUTE)], MINUTE, last_ts=MINUTE)
+        self.assertEqual(gaps, [(2 * MINUTE, 3)])
+
+    def test_no_gaps_without_ts_delta(self):
+        self.assertEqual(validate_ohlcv([bar(0), bar(5 * MINUTE)])[1], [])
+
+
+class FillGapsTest(unittest.TestCase):
+
+    def test_fills_flat_bars(self):
+        rows = [bar(0, close=10.0), bar(3 * MINUTE, close=20.0)]
+        stats = OHLCVStats()
+        filled = fill_gaps(rows, [(MINUTE, 2)], MINUTE, stats=stats)
+
+        self.assertEqual([row[0] for row in filled], [0, MINUTE, 2 * MINUTE, 3 * MINUTE])
+        self.assertEqual(filled[1], [MINUTE, 10.0, 10.0, 10.0, 10.0, 0.0])
+        self.assertEqual(stats.filled, 2)
+
+    def test_gap_at_the_start_uses_prev_close(self):
+        filled = fill_gaps([bar(2 * MINUTE, close=20.0)], [(MINUTE, 1)], MINUTE, prev_close=5.0)
+        self.assertEqual(filled, [[MINUTE, 5.0, 5.0, 5.0, 5.0, 0.0], bar(2 * MINUTE, close=20.0)])
+
+    def test_gap_at_the_start_without_prev_close_is_left(self):
+        rows = [bar(2 * MINUTE)]
+        self.assertEqual(fill_gaps(rows, [(MINUTE, 1)], MINUTE), rows)
+
+
+class AlignAsofTest(unittest.TestCase):
+
+    def test_holds_the_last_value(self):
+        values = align_asof([(10, 1.0), (30, 2.0)], [0, 10, 20, 30, 40])
+        self.assertNotEqual(values[0], values[0])  # nan before the first point
+        self.assertEqual(values[1:], [1.0, 1.0, 2.0, 2.0])
+
+
+class DerivedBarsTest(unittest.TestCase):
+    '''5 minute bars built from the 1 minute bars of a SimulatedExchange feed'''
+
+    def setUp(self):
+        CryptoStore._singleton = None
+        self.store = CryptoStore('simulated', 'USDT', {}, 3, transport_params=dict(mode='simulate'),
+                                 cache_params=None)
+
+    def tearDown(self):
+        CryptoStore._singleton = None
+
+    def test_aggregates_source_bars(self):
+        end = datetime(2022, 1, 1)
+        source = self.store.getdata(dataname='BTC/USDT', timeframe=bt.TimeFrame.Minutes, compression=1,
+                                    fromdate=end - timedelta(hours=1), todate=end, historical=True)
+        derived = self.store.getdata(dataname='BTC/USDT', timeframe=bt.TimeFrame.Minutes, compression=5,
+                                     source=source)
+        cerebro = bt.Cerebro(stdstats=False)
+        cerebro.addstrategy(bt.Strategy)
+        cerebro.adddata(source)
+        cerebro.adddata(derived)
+        cerebro.run()
+
+        # the period starting at ``end`` only has its first minute
+        self.assertEqual(len(derived), 12)
+        exchange = SimulatedExchange()
+        start = int((end - timedelta(hours=1) - datetime(1970, 1, 1)).total_seconds()) // 60
+        for i in range(len(derived)):
+            minutes = [exchange._bar(start + 5 * i + j, MINUTE) for j in range(5)]
+            ago = i - len(derived) + 1
+            self.assertEqual(bt.num2date(derived.datetime[ago]), datetime.utcfromtimestamp(minutes[0][0] / 1000))
+            self.assertAlmostEqual(derived.open[ago], minutes[0][1])
+            self.assertAlmostEqual(derived.high[ago], max(m[2] for m in minutes))
+            self.assertAlmostEqual(derived.low[ago], min(m[3] for m in minutes))
+            self.assertAlmostEqual(derived.close[ago], minutes[-1][4])
+            self.assertAlmostEqual(derived.volume[ago], sum(m[5] for m in minutes))
+
+
+if __name__ == '__main__':
+    unittest.main()
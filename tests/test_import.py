@@ -0,0 +1,32 @@
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ('ccxt', 'backtrader', 'tscache', 'pyarrow')
+
+
+def imported_modules(code):
+    '''Runs ``code`` in a fresh interpreter and returns the heavy packages it imported'''
+    script = code + '''
+import sys
+print(' '.join(sorted(set(m.split('.')[0] for m in sys.modules) & set(%r))))
+''' % (HEAVY,)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+    out = subprocess.check_output([sys.executable, '-c', script], env=env, universal_newlines=True)
+    return out.split()
+
+
+class ImportTimeTest(unittest.TestCase):
+
+    def test_import_is_lazy(self):
+        self.assertEqual(imported_modules('import cryptobt'), [])
+
+    def test_light_components_stay_light(self):
+        modules = imported_modules('import cryptobt\ncryptobt.OrderDispatcher\ncryptobt.configure_logging')
+        self.assertEqual(modules, [])
+
+
+if __name__ == '__main__':
+    unittest.main()